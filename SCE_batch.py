@@ -0,0 +1,150 @@
+# Description: Processes the usage files of many service accounts across a pool of worker processes.
+# The ECC table and tariff are compiled once and handed to each worker when it starts, so every file only costs its
+# own parsing and valuation.  All files of one account are processed together by one worker, and overlapping
+# downloads keep the intervals of the most recently modified file.
+
+import argparse
+import glob
+import os
+import time
+import functools
+import concurrent.futures
+import pandas as pd
+
+from SCE_ecc import load_ecc_table
+from SCE_parse import ECC_FILE, HEADER, TOU_D_PRIME, format_frame, load_tariff, process_frame, read_usage, write_extra, write_output
+from SCE_store import account_from_filename
+
+USAGE_PATTERN = "SCE_Usage_*.csv"
+SUMMARY_COLUMNS = ["account", "files", "intervals", "rows", "seconds", "status", "error"]
+
+# The ECC table and tariff of the worker process, set once by init_worker()
+WORKER_ECC = None
+WORKER_TARIFF = None
+
+def init_worker(ecc, tariff):
+    global WORKER_ECC, WORKER_TARIFF
+    WORKER_ECC, WORKER_TARIFF = ecc, tariff
+
+# Expand directories and glob patterns into the usage files they hold
+def find_usage_files(inputs):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files += glob.glob(os.path.join(item, USAGE_PATTERN))
+        else:
+            files += glob.glob(item)
+    return sorted(set(files))
+
+# Return the usage files grouped by service account, oldest file first
+def group_by_account(files):
+    accounts = {}
+    for infile in sorted(files, key=os.path.getmtime):
+        accounts.setdefault(account_from_filename(infile), []).append(infile)
+    return accounts
+
+# Parse and value every file of one account.  Writes its hourly rows to <output_dir>/<account>_parsed.csv when
+# output_dir is given, and returns them in the compact layout when output_dir is None or keep is set.
+# Errors are returned in the summary, never raised.
+def process_account(account, files, output_dir=None, keep=False):
+    started = time.perf_counter()
+    summary = {"account": account, "files": len(files), "intervals": 0, "rows": 0, "status": "ok", "error": None}
+    data = None
+    try:
+        usage = pd.concat([read_usage(infile) for infile in files], ignore_index=True)
+        usage = usage.drop_duplicates(['Start', 'Tag'], keep='last').sort_values('Start', kind='stable')
+        summary["intervals"] = len(usage)
+        if usage.empty:
+            summary["status"], summary["error"] = "empty", "no interval data"
+            data = usage
+        else:
+            data = process_frame(usage, WORKER_ECC, WORKER_TARIFF)
+        summary["rows"] = len(data)
+        if output_dir is not None:
+            write_output(format_frame(data) if len(data) else pd.DataFrame(columns=HEADER),
+                         os.path.join(output_dir, f"{account}_parsed.csv"))
+            if not keep:
+                data = None
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = f"{type(e).__name__}: {e}"
+        data = None
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary, data
+
+# Process the usage files found in inputs with a pool of workers (all cores by default).
+# Each account is written to <output_dir>/<account>_parsed.csv, or with combined=True all accounts are written to
+# one <output_dir>/combined_parsed.csv with a leading account column.  writers are the extra outputs of
+# SCE_parse.py, e.g. {"parquet": partial(write_dataset, folder=...)}: the workers hand back the compact rows and each
+# writer is called here with the account, so a dataset folder is partitioned by Year and Month across all accounts.
+# Returns one summary row per account.
+def process_batch(inputs, output_dir, ecc_file=ECC_FILE, tariff=TOU_D_PRIME, workers=None, combined=False, writers=None):
+    accounts = group_by_account(find_usage_files(inputs))
+    if not accounts:
+        print("No usage files found.")
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    os.makedirs(output_dir, exist_ok=True)
+    ecc = load_ecc_table(ecc_file) if isinstance(ecc_file, (str, os.PathLike)) else ecc_file
+    workers = min(workers or os.cpu_count() or 1, len(accounts))
+    combined_file = os.path.join(output_dir, "combined_parsed.csv")
+    if combined:
+        pd.DataFrame(columns=['account'] + HEADER).to_csv(combined_file + '.tmp', index=False)
+
+    summaries = []
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(ecc, tariff)) as pool:
+        futures = [pool.submit(process_account, account, files, None if combined else output_dir, bool(writers))
+                   for account, files in accounts.items()]
+        for future in concurrent.futures.as_completed(futures):
+            summary, data = future.result()
+            if data is not None and len(data):
+                try:
+                    if combined:
+                        rows = format_frame(data)
+                        rows.insert(0, 'account', summary["account"])
+                        rows.to_csv(combined_file + '.tmp', mode='a', header=False, index=False, encoding='utf-8')
+                    write_extra(data, {name: functools.partial(writer, account=summary["account"])
+                                       for name, writer in (writers or {}).items()})
+                except Exception as e:
+                    summary["status"] = "failed"
+                    summary["error"] = f"{type(e).__name__}: {e}"
+            summaries.append(summary)
+            print(f"{summary['account']}: {summary['status']} ({summary['rows']} rows in {summary['seconds']}s)")
+    if combined:
+        os.replace(combined_file + '.tmp', combined_file)
+
+    summary = pd.DataFrame(summaries, columns=SUMMARY_COLUMNS).sort_values('account', ignore_index=True)
+    failed = summary[summary['status'] != 'ok']
+    print(f"{len(summary) - len(failed)} of {len(summary)} accounts processed.")
+    for row in failed.itertuples():
+        print(f"Error processing account {row.account}: {row.error}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse the usage files of many SCE accounts in parallel.")
+    parser.add_argument("inputs", nargs="+", help="folders or glob patterns of SCE_Usage_*.csv files")
+    parser.add_argument("--output-dir", required=True, help="folder for the parsed output")
+    parser.add_argument("--combined", action="store_true", help="write every account to one combined_parsed.csv")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    parser.add_argument("--tariff", help="tariff JSON file (default: TOU-D-PRIME)")
+    parser.add_argument("--summary", help="write the per-account summary to this CSV file")
+    parser.add_argument("--parquet", help="also write every account to this Parquet dataset folder")
+    parser.add_argument("--feather", help="also write every account to this Feather dataset folder")
+    parser.add_argument("--sqlite", help="also write every account to this SQLite file")
+    args = parser.parse_args()
+
+    writers = {}
+    if args.parquet or args.feather or args.sqlite:
+        from SCE_dataset import write_dataset, write_sqlite
+        if args.parquet:
+            writers["parquet"] = functools.partial(write_dataset, folder=args.parquet, file_format="parquet")
+        if args.feather:
+            writers["feather"] = functools.partial(write_dataset, folder=args.feather, file_format="feather")
+        if args.sqlite:
+            writers["sqlite"] = functools.partial(write_sqlite, path=args.sqlite)
+
+    tariff = load_tariff(args.tariff) if args.tariff else TOU_D_PRIME
+    summary = process_batch(args.inputs, args.output_dir, args.ecc, tariff, args.workers, args.combined, writers)
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+        print("Summary stored in " + args.summary)
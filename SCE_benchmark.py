@@ -0,0 +1,134 @@
+# Description: Times and memory-profiles each SCE_parse.py stage and the SCE_merge_data.py append on synthetic
+# usage files of increasing size.  Results are saved as JSON so runs of different versions can be compared.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import SCE_merge_data
+from SCE_ecc import load_ecc_table
+from SCE_parse import (HEADER, TOU_D_PRIME, combine_frame, delivery_cost_frame, enrich_frame, format_frame,
+                       normalize_frame, parse_frame, received_value_frame)
+from SCE_synthetic import write_usage_file
+
+SIZES = {"day": 1, "month": 31, "year": 366, "5years": 5 * 365 + 1}
+DEFAULT_ECC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Example_ECC_data.csv")
+
+# Run one stage and record its wall time, CPU time and row counts, or with trace its peak traced memory.
+# tracemalloc hooks every allocation and slows the allocation-heavy stages down, so the times and the memory
+# come from separate runs.
+def measure(results, name, func, *args, rows_in=None, trace=False):
+    if trace:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    output = func(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({"stage": name, "peak_mb": round(peak / 1e6, 3)})
+        return output
+    results.append({
+        "stage": name,
+        "wall_seconds": round(wall, 6),
+        "cpu_seconds": round(cpu, 6),
+        "rows_in": rows_in,
+        "rows_out": len(output) if hasattr(output, '__len__') else None,
+    })
+    return output
+
+# Write a workbook with an empty Table1 to merge into
+def write_workbook(path):
+    from openpyxl import Workbook
+    from openpyxl.worksheet.table import Table
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = SCE_merge_data.worksheet_name
+    worksheet.append(HEADER)
+    worksheet.append([datetime.date(2024, 1, 1), "00:00", "01:00", 0.0, "delivered", "Winter", 2024, "January",
+                      "Winter", "Weekday", "Off-Peak", 0.0])
+    worksheet.add_table(Table(displayName=SCE_merge_data.table_name, ref=f"A1:{SCE_merge_data.colnum_string(len(HEADER))}2"))
+    workbook.save(path)
+
+# Run every stage once on the usage file, timing them or tracing their memory
+def run_stages(folder, infile, ecc, trace=False):
+    results = []
+    data = measure(results, "parse", parse_frame, infile, trace=trace)
+    data = measure(results, "enrich", enrich_frame, data, TOU_D_PRIME, rows_in=len(data), trace=trace)
+    data = measure(results, "normalize", normalize_frame, data, rows_in=len(data), trace=trace)
+    data = measure(results, "delivery_cost", delivery_cost_frame, data, TOU_D_PRIME, rows_in=len(data), trace=trace)
+    data = measure(results, "received_value", received_value_frame, data, ecc, rows_in=len(data), trace=trace)
+    data = measure(results, "combine", combine_frame, data, rows_in=len(data), trace=trace)
+    data = measure(results, "format", format_frame, data, rows_in=len(data), trace=trace)
+
+    workbook = os.path.join(folder, "master.xlsx")
+    write_workbook(workbook)
+    rows = SCE_merge_data.read_csv_data(data)
+    measure(results, "merge", SCE_merge_data.append_rows, workbook, SCE_merge_data.worksheet_name,
+            SCE_merge_data.table_name, rows, rows_in=len(rows), trace=trace)
+    return results
+
+# Benchmark every stage on a synthetic file covering the given number of days: one run for the times and a
+# second, traced run for the peak memory of each stage
+def run_size(folder, days, ecc):
+    infile = write_usage_file(os.path.join(folder, f"SCE_Usage_{days}.csv"), days)
+    results = run_stages(folder, infile, ecc)
+    for result, traced in zip(results, run_stages(folder, infile, ecc, trace=True)):
+        result["peak_mb"] = traced["peak_mb"]
+        result["input_bytes"] = os.path.getsize(infile)
+    return results
+
+# The commit being benchmarked, when run from a git checkout
+def git_version():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# Print the wall time of each stage against a previous report
+def compare_reports(current, previous):
+    def times(report):
+        return {(size, r["stage"]): r["wall_seconds"] for size, results in report["sizes"].items() for r in results}
+    before, after = times(previous), times(current)
+    rows = [(size, stage, before[size, stage], after[size, stage], before[size, stage] / max(after[size, stage], 1e-9))
+            for size, stage in after if (size, stage) in before]
+    print(pd.DataFrame(rows, columns=["size", "stage", "before_s", "after_s", "speedup"]).to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SCE parse and merge stages on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--ecc", default=DEFAULT_ECC_FILE, help="ECC data file")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report to write")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args()
+
+    report = {
+        "version": git_version(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "sizes": {},
+    }
+    ecc = load_ecc_table(args.ecc)
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            report["sizes"][size] = run_size(folder, SIZES[size], ecc)
+            total = sum(result["wall_seconds"] for result in report["sizes"][size])
+            print(f"{size}: {total:.2f}s")
+
+    with open(args.output, "w", encoding="utf-8") as f_out:
+        json.dump(report, f_out, indent=2)
+    print("Benchmark stored in " + args.output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f_in:
+            compare_reports(report, json.load(f_in))
@@ -0,0 +1,95 @@
+# Description: Compares what a household would have paid under several rate plans.
+# The usage file is parsed and netted once.  Every plan is then costed in one pass by gathering a
+# (interval x plan) rate matrix and summing it by month.
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from SCE_ecc import load_ecc_table
+from SCE_parse import BONUS, ECC_FILE, TOU_D_PRIME, normalize_frame, parse_frame, usage_kwh
+from SCE_tariff import load_tariff
+
+SUMMARY_COLUMNS = ["Plan", "Tariff", "Bonus", "Year", "Month", "DeliveredkwH", "GeneratedkwH",
+                   "DeliveryCost", "GeneratedValue", "NetCost"]
+
+# Return the monthly bill of every plan.  A plan is one tariff combined with one ECC bonus, so
+# len(tariffs) * len(bonuses) plans are evaluated.  data is netted interval usage as returned by
+# normalize_frame(), and ecc_file is a path or an already compiled EccTable.
+def compare_plans(data, tariffs, bonuses=(BONUS,), ecc_file=ECC_FILE):
+    ecc = load_ecc_table(ecc_file) if isinstance(ecc_file, (str, os.PathLike)) else ecc_file
+    starts = pd.DatetimeIndex(data['Start'])
+    kwHUsage = usage_kwh(data)
+    delivered = np.where(data['Tag'].to_numpy() == 'delivered', kwHUsage, 0)
+    generated = np.where(data['Tag'].to_numpy() == 'generated', kwHUsage, 0)
+
+    # The ECC data counts hours from 1 to 24
+    hours = np.where(starts.hour == 0, 24, starts.hour)
+    months, month_keys = pd.factorize(starts.to_period('M'), sort=True)
+
+    # One column per tariff: delivery rate and ECC factor of every interval
+    rates = np.empty((len(data), len(tariffs)))
+    factors = np.empty((len(data), len(tariffs)))
+    for j, tariff in enumerate(tariffs):
+        seasons, minutes = tariff.slots(starts)
+        rates[:, j] = tariff.rate_table[seasons, minutes]
+        weekend = np.array(tariff.slot_day_types)[minutes // (24 * 60)] == 'Weekend'
+        factors[:, j] = ecc.lookup(starts.year, starts.month, hours, weekend)
+
+    missing = np.isnan(factors).any(axis=1) & (generated != 0)
+    if missing.any():
+        periods = sorted({str(month) for month in starts[missing].to_period('M')})
+        print("No ECC data for " + ", ".join(periods) + "; generated value left at 0.")
+    factors = np.nan_to_num(factors)
+
+    # The generated value is kwH * (ECC + kwH * bonus), so the bonus term is summed separately.  Intervals without an
+    # ECC factor get no bonus either, as in received_value_frame().
+    bonus_kwh = np.where(missing, 0, generated ** 2)
+    columns = np.column_stack([delivered, generated, delivered[:, None] * rates, generated[:, None] * factors, bonus_kwh])
+    monthly = np.zeros((len(month_keys), columns.shape[1]))
+    np.add.at(monthly, months, columns)
+
+    n = len(tariffs)
+    delivered_kwh, generated_kwh = monthly[:, 0], monthly[:, 1]
+    delivery_cost, ecc_value, bonus_kwh = monthly[:, 2:2 + n], monthly[:, 2 + n:2 + 2 * n], monthly[:, 2 + 2 * n]
+
+    frames = []
+    for j, tariff in enumerate(tariffs):
+        for bonus in bonuses:
+            value = ecc_value[:, j] + bonus * bonus_kwh
+            frames.append(pd.DataFrame({
+                "Plan": f"{tariff.name} (bonus {bonus})",
+                "Tariff": tariff.name,
+                "Bonus": bonus,
+                "Year": month_keys.year,
+                "Month": month_keys.month,
+                "DeliveredkwH": delivered_kwh,
+                "GeneratedkwH": generated_kwh,
+                "DeliveryCost": delivery_cost[:, j],
+                "GeneratedValue": value,
+                "NetCost": delivery_cost[:, j] - value,
+            }))
+    return pd.concat(frames, ignore_index=True)[SUMMARY_COLUMNS]
+
+# Total the monthly summary per plan, cheapest plan first
+def rank_plans(summary):
+    totals = summary.groupby(["Plan", "Tariff", "Bonus"], sort=False)[["DeliveryCost", "GeneratedValue", "NetCost"]].sum()
+    return totals.sort_values("NetCost").reset_index()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the bill for an SCE usage file under several rate plans.")
+    parser.add_argument("input_file", help="SCE_Usage.csv file downloaded from SCE")
+    parser.add_argument("tariffs", nargs="*", help="tariff JSON files (default: TOU-D-Prime)")
+    parser.add_argument("--bonus", type=float, nargs="+", default=[BONUS], help="ECC bonus values to compare")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    parser.add_argument("--output", help="write the monthly summary to this CSV file")
+    args = parser.parse_args()
+
+    tariffs = [load_tariff(path) for path in args.tariffs] or [TOU_D_PRIME]
+    usage = normalize_frame(parse_frame(args.input_file))
+    summary = compare_plans(usage, tariffs, args.bonus, args.ecc)
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print("Summary stored in " + args.output)
+    print(rank_plans(summary).to_string(index=False))
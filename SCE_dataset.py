@@ -0,0 +1,159 @@
+# Description: Writes parsed rows as a columnar dataset partitioned by year and month (Parquet or Feather) or as
+# an indexed SQLite table, and reads them back with only the partitions or index ranges a query needs.
+# The rows keep the compact typed layout of SCE_parse.py.  Parquet and Feather need pyarrow; SQLite does not.
+
+import glob
+import os
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from SCE_parse import COLUMNS, MONTH_DTYPE, SEASON_DTYPE, TAG_DTYPE, usage_kwh
+
+EXTENSIONS = {"parquet": ".parquet", "feather": ".feather"}
+PARTITION_PATTERN = re.compile(r'Year=(\d+)[\\/]Month=(\d+)[\\/]([^\\/]+)\.(parquet|feather)$')
+DEFAULT_ACCOUNT = 'default'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+LABEL_COLUMNS = ["Tag", "Season", "Month", "BillingSeason", "BillingDay", "TOU"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intervals (
+    account TEXT NOT NULL, Start TEXT NOT NULL, Minutes INTEGER, kwHUsage REAL, Tag TEXT NOT NULL, Season TEXT,
+    Year INTEGER, Month TEXT, BillingSeason TEXT, BillingDay TEXT, TOU TEXT, Cost REAL,
+    PRIMARY KEY (account, Start, Tag));
+CREATE INDEX IF NOT EXISTS intervals_start ON intervals (Start, Tag, TOU);
+"""
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Feather output need pyarrow: pip install pyarrow") from None
+
+# Restore the compact dtypes of rows read back from a file or query
+def typed(data):
+    data = data.copy()
+    data['Start'] = pd.to_datetime(data['Start']).astype('datetime64[s]')
+    data['Minutes'] = data['Minutes'].astype(np.int16)
+    data['kwHUsage'] = data['kwHUsage'].astype(np.float32)
+    data['Year'] = data['Year'].astype(np.int16)
+    for column, dtype in (('Tag', TAG_DTYPE), ('Season', SEASON_DTYPE), ('Month', MONTH_DTYPE)):
+        data[column] = data[column].astype(object).astype(dtype)
+    for column in ['BillingSeason', 'BillingDay', 'TOU']:
+        data[column] = data[column].astype(object).astype('category')
+    return data
+
+# Write rows to <folder>/Year=YYYY/Month=MM/<account>.parquet (or .feather).  Rows already stored for the account
+# are kept, and rows with the same interval start and tag are replaced, so overlapping downloads can be written.
+def write_dataset(data, folder, account=DEFAULT_ACCOUNT, file_format="parquet"):
+    require_pyarrow()
+    starts = pd.DatetimeIndex(data['Start'])
+    keys = starts.year.to_numpy() * 100 + starts.month.to_numpy()
+    for key in np.unique(keys):
+        path = os.path.join(folder, f"Year={key // 100}", f"Month={key % 100:02}", account + EXTENSIONS[file_format])
+        part = data.loc[keys == key, COLUMNS]
+        if os.path.exists(path):
+            stored = read_part(path)
+            part = pd.concat([stored, part], ignore_index=True).drop_duplicates(['Start', 'Tag'], keep='last')
+        part = typed(part.sort_values(['Start', 'Tag'], kind='stable').reset_index(drop=True))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if file_format == "parquet":
+            part.to_parquet(path + '.tmp', index=False)
+        else:
+            part.to_feather(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+def read_part(path, columns=None):
+    if path.endswith(EXTENSIONS["parquet"]):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+# Return the rows of a dataset between start and end (end is exclusive).  Only the year/month partitions that
+# overlap the range, and only the files of the account, are read.  Any other keyword selects rows by column
+# value, e.g. query_dataset(folder, "2024-07-01", "2024-08-01", BillingDay="Weekday", TOU="On-Peak").
+def query_dataset(folder, start=None, end=None, account=None, **filters):
+    require_pyarrow()
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    parts = []
+    for path in sorted(glob.glob(os.path.join(folder, "Year=*", "Month=*", "*"))):
+        match = PARTITION_PATTERN.search(path)
+        if match is None:
+            continue
+        month = pd.Timestamp(int(match.group(1)), int(match.group(2)), 1)
+        if (start is not None and month + pd.offsets.MonthBegin(1) <= start) or (end is not None and month >= end):
+            continue
+        if account is not None and match.group(3) != account:
+            continue
+        if 'Year' in filters and month.year != filters['Year']:
+            continue
+        part = read_part(path)
+        part.insert(0, 'account', match.group(3))
+        parts.append(part)
+    if not parts:
+        return typed(pd.DataFrame(columns=['account'] + COLUMNS))
+    data = pd.concat(parts, ignore_index=True)
+    return select(typed(data), start, end, filters)
+
+def select(data, start, end, filters):
+    mask = np.ones(len(data), dtype=bool)
+    if start is not None:
+        mask &= (data['Start'] >= start).to_numpy()
+    if end is not None:
+        mask &= (data['Start'] < end).to_numpy()
+    for column, value in filters.items():
+        mask &= (data[column] == value).to_numpy()
+    return data[mask].sort_values(['Start', 'Tag'], kind='stable').reset_index(drop=True)
+
+# Insert or replace rows in the intervals table of a SQLite file
+def write_sqlite(data, path, account=DEFAULT_ACCOUNT):
+    rows = pd.DataFrame({
+        'account': account,
+        'Start': data['Start'].dt.strftime(TIME_FORMAT),
+        'Minutes': data['Minutes'].astype(np.int64),
+        'kwHUsage': usage_kwh(data),
+        **{column: data[column].astype(object) for column in ['Tag', 'Season']},
+        'Year': data['Year'].astype(np.int64),
+        **{column: data[column].astype(object) for column in ['Month', 'BillingSeason', 'BillingDay', 'TOU']},
+        'Cost': data['Cost'].astype(float),
+    })
+    con = sqlite3.connect(path)
+    try:
+        con.executescript(SCHEMA)
+        with con:
+            con.executemany(f"INSERT OR REPLACE INTO intervals VALUES ({', '.join('?' * len(rows.columns))})",
+                            rows.itertuples(index=False))
+    finally:
+        con.close()
+
+# Return the rows of a SQLite file between start and end (end is exclusive), using the (Start, Tag, TOU) index.
+# Any other keyword selects rows by column value, as in query_dataset().
+def query_sqlite(path, start=None, end=None, account=None, **filters):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("Start >= ?")
+        params.append(pd.Timestamp(start).strftime(TIME_FORMAT))
+    if end is not None:
+        clauses.append("Start < ?")
+        params.append(pd.Timestamp(end).strftime(TIME_FORMAT))
+    if account is not None:
+        clauses.append("account = ?")
+        params.append(account)
+    for column, value in filters.items():
+        if column not in COLUMNS:
+            raise KeyError(f"Unknown column {column}")
+        clauses.append(f"{column} = ?")
+        params.append(value)
+    query = "SELECT * FROM intervals" + (" WHERE " + " AND ".join(clauses) if clauses else "") + " ORDER BY Start, Tag"
+    con = sqlite3.connect(path)
+    try:
+        return typed(pd.read_sql_query(query, con, params=params))
+    finally:
+        con.close()
+
+# Query a dataset folder or a SQLite file
+def query_intervals(source, start=None, end=None, account=None, **filters):
+    if os.path.isdir(source):
+        return query_dataset(source, start, end, account, **filters)
+    return query_sqlite(source, start, end, account, **filters)
@@ -1,14 +1,51 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import time
+import argparse
 import datetime
 import getpass
+import http.client
+import queue
 import shutil
 import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import concurrent.futures
 from pathlib import Path
 
+# Change BASE_URL to the stand-in server of SCE_standin.py to test the downloads without an SCE account
+BASE_URL = "https://www.sce.com"
+LOGIN_PATH = "/mysce/login"
+DATA_PATH = "/sma/ESCAA/EscGreenButtonData"
+# The CSV export of SCE_standin.py, with the form's fromDate, toDate and format fields as query parameters.  SCE's own
+# export request carries a reCAPTCHA token and has not been captured, so download_chunks() only runs against the
+# stand-in; sce.com is downloaded through the real form by download_chunks_browser().
+DOWNLOAD_PATH = DATA_PATH + "/download"
+# Files are named the way SCE names its downloads, so SCE_store.py, SCE_batch.py and SCE_watch.py find the account
+ACCOUNT = "YourAccountNumberHere"
+# Days per downloaded file, files downloaded at once over HTTP by download_chunks(), and browsers kept open at once
+# by download_chunks_browser()
+CHUNK_DAYS = 31
+DOWNLOAD_WORKERS = 4
+BROWSER_WORKERS = 2
+# Seconds a browser waits for its file, which includes the time taken to solve the reCAPTCHA and click Download
+FORM_TIMEOUT = 600
+DATE_FORMAT = "%m/%d/%y"
+# Chrome writes a download to <name>.crdownload until it is complete
+PARTIAL_SUFFIXES = (".crdownload", ".tmp")
+
+USERNAME_XPATH = "//*[@id='userName']"
+PASSWORD_XPATH = "//*[@id='password']"
+LOGON_BUTTON_XPATH = "//*[@id='react-login-main']/div/div/section/div[3]/form/div[2]/div[4]/button"
+DSS_MODAL_XPATH = "//*[@id='DSSModal']/div/div/div[1]/button"
+DOWNLOAD_BUTTON_XPATH = "//*[@id='datadownload-content']/div/div/div/section/div/div[2]/div[4]/div[2]/div/div/div[2]"
+FROM_DATE_XPATH = "//*[@id='fromDateTextBox']"
+TO_DATE_XPATH = "//*[@id='toDateTextBox']"
+CSV_RADIO_XPATH = "//*[@id='datadownload-content']/div/div/div/section/div/div[2]/div[3]/div[2]/fieldset/ul/li[1]/div/label/input"
+RECAPTCHA_FRAME_CSS = "iframe[name^='a-'][src^='https://www.google.com/recaptcha/api2/anchor?']"
+RECAPTCHA_XPATH = "//span[@id='recaptcha-anchor']"
+
 # Function to get the date range from the user
 def get_date():
     today = datetime.date.today().strftime("%m/%d/%y")
@@ -34,73 +71,268 @@ def get_download_folder():
 
     return dl_folder
 
-def main():
-    timeout = 10 #seconds
+# Start Chrome, saving downloads to download_folder without asking when it is given
+def start_driver(download_folder=None, headless=False):
+    from selenium import webdriver
 
     chrome_options = webdriver.ChromeOptions()
     chrome_options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    if download_folder:
+        chrome_options.add_experimental_option("prefs", {"download.default_directory": os.path.abspath(download_folder),
+                                                         "download.prompt_for_download": False})
+    if headless:
+        chrome_options.add_argument("--headless=new")
+    return webdriver.Chrome(options=chrome_options)
+
+# Enter the credentials (asked for when not given) on the login page and wait until the browser has left it
+def log_in(driver, base_url=BASE_URL, timeout=10, credentials=None):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # Navigate to the login page
+    driver.get(base_url + LOGIN_PATH)
+
+    # Wait for the page to load
+    WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, USERNAME_XPATH)))
+
+    # Enter login credentials
+    username, password = credentials or user_pass()
+    username_input = driver.find_elements(By.XPATH, USERNAME_XPATH)
+    password_input = driver.find_elements(By.XPATH, PASSWORD_XPATH)
+    logon_button = driver.find_elements(By.XPATH, LOGON_BUTTON_XPATH)
+
+    username_input[1].send_keys(username)
+    password_input[1].send_keys(password)
+    logon_button[0].click()
 
+    # Wait for the login to complete instead of sleeping for a fixed time
+    WebDriverWait(driver, timeout).until(lambda d: LOGIN_PATH not in d.current_url or d.find_elements(By.XPATH, DSS_MODAL_XPATH))
+
+# Log in once with a browser and return its session cookies, so every date range can then be fetched over HTTP
+# without starting another browser
+def session_cookies(base_url=BASE_URL, headless=False, timeout=30):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    driver = start_driver(headless=headless)
     try:
-        driver = webdriver.Chrome(options=chrome_options)
+        log_in(driver, base_url, timeout)
+        driver.get(base_url + DATA_PATH)
+        WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, DOWNLOAD_BUTTON_XPATH)))
+        return {cookie["name"]: cookie["value"] for cookie in driver.get_cookies()}
+    finally:
+        driver.quit()
+
+# Open the download form on the Download My Data page, enter the date range (MM/DD/YY), choose CSV and tick the
+# reCAPTCHA checkbox.  Solving a reCAPTCHA challenge and clicking Download are left to the user.
+def fill_form(driver, start_date, end_date, timeout=10):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, DOWNLOAD_BUTTON_XPATH)))
+    driver.find_element(By.XPATH, DOWNLOAD_BUTTON_XPATH).click()
+    driver.find_element(By.XPATH, FROM_DATE_XPATH).send_keys(start_date)
+    driver.find_element(By.XPATH, TO_DATE_XPATH).send_keys(end_date)
+    driver.find_element(By.XPATH, CSV_RADIO_XPATH).click()
+
+    # Click on reCaptcha checkbox
+    WebDriverWait(driver, timeout).until(EC.frame_to_be_available_and_switch_to_it((By.CSS_SELECTOR, RECAPTCHA_FRAME_CSS)))
+    WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((By.XPATH, RECAPTCHA_XPATH))).click()
+    driver.switch_to.default_content()
 
-        # Navigate to the login page
-        driver.get("https://www.sce.com/mysce/login")
+# Split the range from start to end (both included) into consecutive ranges of at most chunk_days days
+def date_chunks(start, end, chunk_days=CHUNK_DAYS):
+    chunks = []
+    while start <= end:
+        last = min(start + datetime.timedelta(days=chunk_days - 1), end)
+        chunks.append((start, last))
+        start = last + datetime.timedelta(days=1)
+    return chunks
 
-        # Wait for the page to load
-        wait = WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, "//*[@id='userName']")))
+def chunk_name(start, end, account=ACCOUNT):
+    return f"SCE_Usage_{account}_{start:%m-%d-%y}_to_{end:%m-%d-%y}.csv"
 
-        # Enter login credentials
-        username, password = user_pass()
-        username_input = driver.find_elements(By.XPATH, "//*[@id='userName']")
-        password_input = driver.find_elements(By.XPATH, "//*[@id='password']")
-        logon_button = driver.find_elements(By.XPATH, "//*[@id='react-login-main']/div/div/section/div[3]/form/div[2]/div[4]/button")
+# Download the usage file of one date range into the folder over HTTP with the session cookies.  The file is
+# written to <name>.part and renamed when it is complete, so a finished range is skipped and an interrupted one
+# is continued from where it stopped (with an HTTP Range request) the next time it is downloaded.
+def download_range(start, end, folder, cookies, base_url=BASE_URL, account=ACCOUNT, timeout=60, retries=3):
+    dest = os.path.join(folder, chunk_name(start, end, account))
+    if os.path.exists(dest):
+        return dest
+    part = dest + ".part"
+    query = urllib.parse.urlencode({"fromDate": start.strftime(DATE_FORMAT), "toDate": end.strftime(DATE_FORMAT), "format": "csv"})
+    headers = {"Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items())}
 
-        username_input[1].send_keys(username)
-        password_input[1].send_keys(password)
-        logon_button[0].click()
+    for attempt in range(1, retries + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        else:
+            headers.pop("Range", None)
+        try:
+            request = urllib.request.Request(f"{base_url}{DOWNLOAD_PATH}?{query}", headers=headers)
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                # An expired session is sent back to the login page
+                if response.headers.get_content_type() == "text/html":
+                    raise PermissionError("the session is no longer logged in")
+                if response.status != 206:
+                    offset = 0
+                length = response.headers.get("Content-Length")
+                with open(part, "ab" if offset else "wb") as f_out:
+                    shutil.copyfileobj(response, f_out)
+            if length is None or os.path.getsize(part) == offset + int(length):
+                os.replace(part, dest)
+                return dest
+            print(f"Download of {start:%m/%d/%y} to {end:%m/%d/%y} was cut short, resuming...")
+        except (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError) as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code < 500:
+                raise
+            print(f"Download of {start:%m/%d/%y} to {end:%m/%d/%y} failed ({e}), attempt {attempt} of {retries}...")
+    raise RuntimeError(f"could not download {start:%m/%d/%y} to {end:%m/%d/%y} after {retries} attempts")
+
+# Wait for the browser to finish a download into the folder and return its path
+def wait_for_download(folder, timeout=FORM_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        names = os.listdir(folder)
+        done = [name for name in names if not name.startswith(".") and not name.endswith(PARTIAL_SUFFIXES)
+                and not any(name + suffix in names for suffix in PARTIAL_SUFFIXES)]
+        if done:
+            return os.path.join(folder, done[0])
+        time.sleep(0.5)
+    raise TimeoutError(f"no download finished within {timeout}s")
+
+# Download one date range through the form in a logged-in browser whose downloads go to work_folder, and move the
+# file into the folder under its chunk name.  A range that is already there is skipped, and a session that has
+# expired is logged in again.
+def download_range_browser(driver, start, end, folder, work_folder, credentials, base_url=BASE_URL, account=ACCOUNT,
+                           timeout=10):
+    dest = os.path.join(folder, chunk_name(start, end, account))
+    if os.path.exists(dest):
+        return dest
+    # Clear what a failed range left behind, so its file is not taken for this one
+    for name in os.listdir(work_folder):
+        os.remove(os.path.join(work_folder, name))
+
+    driver.get(base_url + DATA_PATH)
+    if LOGIN_PATH in driver.current_url:
+        print("The session has expired, logging in again...")
+        log_in(driver, base_url, timeout, credentials)
+        driver.get(base_url + DATA_PATH)
+    fill_form(driver, start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT), timeout)
+    print(f"Complete the reCAPTCHA and click Download for {start:%m/%d/%y} to {end:%m/%d/%y}...")
+    shutil.move(wait_for_download(work_folder), dest)
+    return dest
+
+# Download the range from start to end as chunk_days files through SCE's own form, with a pool of up to workers
+# browsers.  Ranges already in the folder are skipped.  The credentials are asked for once, and every browser logs in
+# and then works through the remaining ranges, so several forms can be waiting for their reCAPTCHA at once.
+# Returns the downloaded files; running it again resumes the ranges that failed.
+def download_chunks_browser(start, end, folder, base_url=BASE_URL, account=ACCOUNT, chunk_days=CHUNK_DAYS, workers=BROWSER_WORKERS):
+    chunks = date_chunks(start, end, chunk_days)
+    os.makedirs(folder, exist_ok=True)
+    paths, lock = [], threading.Lock()
+    ranges = queue.Queue()
+    for first, last in chunks:
+        dest = os.path.join(folder, chunk_name(first, last, account))
+        if os.path.exists(dest):
+            paths.append(dest)
+        else:
+            ranges.put((first, last))
+    workers = max(1, min(workers, ranges.qsize()))
+    credentials = user_pass() if not ranges.empty() else None
+
+    # One browser of the pool, with its own download folder so its files cannot be mixed up with the others'
+    def work():
+        with tempfile.TemporaryDirectory(prefix="sce_download_") as work_folder:
+            driver = start_driver(work_folder)
+            try:
+                log_in(driver, base_url, credentials=credentials)
+                while True:
+                    try:
+                        first, last = ranges.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        path = download_range_browser(driver, first, last, folder, work_folder, credentials, base_url, account)
+                        with lock:
+                            paths.append(path)
+                        print(f"Downloaded {first:%m/%d/%y} to {last:%m/%d/%y}...")
+                    except Exception as e:
+                        print(f"Download error for {first:%m/%d/%y} to {last:%m/%d/%y}: {e}")
+            finally:
+                driver.quit()
+
+    if not ranges.empty():
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for future in [pool.submit(work) for _ in range(workers)]:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Browser error: {e}")
+    print(f"{len(paths)} of {len(chunks)} date ranges downloaded to {folder}.")
+    if len(paths) < len(chunks):
+        print("Run the download again to resume the missing ranges.")
+    return sorted(paths)
+
+# Download the range from start to end as chunk_days files over HTTP from DOWNLOAD_PATH (the SCE_standin.py server),
+# up to workers at a time, with the cookies of one session.  Returns the downloaded files; running it again resumes the ranges that failed.
+def download_chunks(start, end, folder, cookies, base_url=BASE_URL, account=ACCOUNT, chunk_days=CHUNK_DAYS, workers=DOWNLOAD_WORKERS):
+    chunks = date_chunks(start, end, chunk_days)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(chunks)))) as pool:
+        futures = {pool.submit(download_range, first, last, folder, cookies, base_url, account): (first, last)
+                   for first, last in chunks}
+        for future in concurrent.futures.as_completed(futures):
+            first, last = futures[future]
+            try:
+                paths.append(future.result())
+                print(f"Downloaded {first:%m/%d/%y} to {last:%m/%d/%y}...")
+            except Exception as e:
+                print(f"Download error for {first:%m/%d/%y} to {last:%m/%d/%y}: {e}")
+    print(f"{len(paths)} of {len(chunks)} date ranges downloaded to {folder}.")
+    if len(paths) < len(chunks):
+        print("Run the download again to resume the missing ranges.")
+    return sorted(paths)
+
+# Download the usage file and return its new location, or None if the download failed.
+# Selenium is only imported here, so the other stages can import this module without it.
+def main():
+    from selenium.webdriver.common.by import By
+
+    timeout = 10 #seconds
+
+    try:
+        driver = start_driver()
+
+        # Log in and wait for the page after the login to load
+        log_in(driver, BASE_URL, timeout)
 
     except Exception as e:
         print(f"Login error: {e}")
 
     try:
-        # Wait for the page to load
-        time.sleep(timeout)
-
-        noob_window = driver.find_elements(By.XPATH, "//*[@id='DSSModal']/div/div/div[1]/button")
-        current_usage_button = driver.find_elements(By.XPATH, "//*[@id='react-login-main']/div/div/section/div[3]/form/div[2]/div[4]/button")
+        noob_window = driver.find_elements(By.XPATH, DSS_MODAL_XPATH)
 
         if len(noob_window) != 0:
             noob_window[0].click()
-            driver.get("https://www.sce.com/sma/ESCAA/EscGreenButtonData")
+            driver.get(BASE_URL + DATA_PATH)
         else:
-            driver.get("https://www.sce.com/sma/ESCAA/EscGreenButtonData")
+            driver.get(BASE_URL + DATA_PATH)
 
     except Exception as e:
         print(f"Navigation error: {e}")
 
     try:    
-        # Wait for the page to load
-        wait = WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, "//*[@id='datadownload-content']/div/div/div/section/div/div[2]/div[4]/div[2]/div/div/div[2]")))  
-
-        # Click on elements and enter date range
-        download_data_button = driver.find_element(By.XPATH, "//*[@id='datadownload-content']/div/div/div/section/div/div[2]/div[4]/div[2]/div/div/div[2]")
-        download_data_button.click()
-        
         # Function to get the date range from the user
         dates = get_date() 
 
-        from_date_range_input = driver.find_element(By.XPATH, "//*[@id='fromDateTextBox']")
-        to_date_range_input = driver.find_element(By.XPATH, "//*[@id='toDateTextBox']")
-
-        from_date_range_input.send_keys(dates[0])
-        to_date_range_input.send_keys(dates[1])
-
-        csv_radio_button = driver.find_element(By.XPATH, "//*[@id='datadownload-content']/div/div/div/section/div/div[2]/div[3]/div[2]/fieldset/ul/li[1]/div/label/input")
-        csv_radio_button.click()
-
-        # Click on reCaptcha checkbox
-        WebDriverWait(driver, 10).until(EC.frame_to_be_available_and_switch_to_it((By.CSS_SELECTOR,"iframe[name^='a-'][src^='https://www.google.com/recaptcha/api2/anchor?']")))
-        WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.XPATH, "//span[@id='recaptcha-anchor']"))).click()
+        # Wait for the page to load, enter the date range and click on the reCaptcha checkbox
+        fill_form(driver, dates[0], dates[1], timeout)
         input("Press Enter when done with Recaptcha and downloading the file...")
     except Exception as e:
         print(f"Date rangee, CSV radio button, or Recpatcha error: {e} ")
@@ -121,13 +353,38 @@ def main():
         dest = r"SCE_Usage.csv"
         shutil.move(source, dest)
         print("File moved successfully!")
+        return dest
     except Exception as e:
         print(f"File move error: {e}")
 
 # Main function to run the program
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download SCE usage data.  Without --start, the date range is entered interactively.")
+    parser.add_argument("--start", help="first day to download, MM/DD/YY; downloads the range in chunks")
+    parser.add_argument("--end", help="last day to download, MM/DD/YY (default: today)")
+    parser.add_argument("--folder", default=get_download_folder(), help="folder for the downloaded files (default: your Downloads folder)")
+    parser.add_argument("--account", default=ACCOUNT, help="service account used in the file names")
+    parser.add_argument("--chunk-days", type=int, default=CHUNK_DAYS, help="days per downloaded file")
+    parser.add_argument("--workers", type=int, help=f"browsers open at once, or files downloaded at once with --http (default: {BROWSER_WORKERS}, or {DOWNLOAD_WORKERS} with --http)")
+    parser.add_argument("--base-url", default=BASE_URL, help="site to download from, e.g. the SCE_standin.py server")
+    parser.add_argument("--http", action="store_true", help="log in once and download the chunks over HTTP (SCE_standin.py only)")
+    parser.add_argument("--headless", action="store_true", help="log in without showing the browser (with --http)")
+    args = parser.parse_args()
 
-
-    main()
+    if args.start and not args.http:
+        start = datetime.datetime.strptime(args.start, DATE_FORMAT).date()
+        end = datetime.datetime.strptime(args.end, DATE_FORMAT).date() if args.end else datetime.date.today()
+        download_chunks_browser(start, end, args.folder, args.base_url, args.account, args.chunk_days, args.workers or BROWSER_WORKERS)
+    elif args.start:
+        start = datetime.datetime.strptime(args.start, DATE_FORMAT).date()
+        end = datetime.datetime.strptime(args.end, DATE_FORMAT).date() if args.end else datetime.date.today()
+        try:
+            cookies = session_cookies(args.base_url, args.headless)
+        except Exception as e:
+            print(f"Login error: {e}")
+        else:
+            download_chunks(start, end, args.folder, cookies, args.base_url, args.account, args.chunk_days, args.workers or DOWNLOAD_WORKERS)
+    else:
+        main()
     print("Done!")
 
@@ -0,0 +1,83 @@
+# Description: Compiles SCE's Energy Export Credit (ECC) factors into a dense lookup table.
+# The table is indexed by (year, month, hour, weekday/weekend) with the generation and delivery
+# components pre-summed, so valuing the generated rows is a single array gather.
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+# Bump this when the layout of the cached table changes
+CACHE_VERSION = 1
+
+# Return the path of the on-disk cache for an ECC data file
+def cache_path(ecc_file):
+    return os.path.splitext(ecc_file)[0] + ".ecc.npz"
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class EccTable:
+    def __init__(self, first_year, table):
+        self.first_year = int(first_year)
+        # table[year - first_year, month - 1, hour - 1, weekend] with NaN where SCE published no factor
+        self.table = table
+
+    # Compile the table from an ECC data file.  The ECC data counts hours from 1 to 24.
+    @classmethod
+    def from_csv(cls, ecc_file):
+        reference_df = pd.read_csv(ecc_file).dropna(subset=['Price Effective Date', 'Month', 'Hour'])
+        years = reference_df['Price Effective Date'].to_numpy(dtype=int)
+        first_year = years.min()
+        table = np.full((years.max() - first_year + 1, 12, 24, 2), np.nan)
+        index = (years - first_year, reference_df['Month'].to_numpy(dtype=int) - 1, reference_df['Hour'].to_numpy(dtype=int) - 1)
+        table[index + (0,)] = reference_df['SCE Gen - Weekday EEC'] + reference_df['Delivery - Weekday EEC']
+        table[index + (1,)] = reference_df['SCE Gen - Weekend/Holiday EEC'] + reference_df['Delivery - Weekend/Holiday EEC']
+        return cls(first_year, table)
+
+    # Look up the combined ECC factor for each interval.  Hours are 1 to 24 as in the ECC data.
+    # Intervals outside the table come back as NaN.
+    def lookup(self, years, months, hours, weekend):
+        years = np.asarray(years, dtype=int) - self.first_year
+        months = np.asarray(months, dtype=int) - 1
+        hours = np.asarray(hours, dtype=int) - 1
+        weekend = np.asarray(weekend, dtype=int)
+        in_range = (years >= 0) & (years < self.table.shape[0])
+        factors = np.full(len(years), np.nan)
+        factors[in_range] = self.table[years[in_range], months[in_range], hours[in_range], weekend[in_range]]
+        return factors
+
+# Load the compiled ECC table, re-using the on-disk cache unless the source file has changed.
+# The cache is keyed on the file's mtime first and its SHA-256 when the mtime differs.
+def load_ecc_table(ecc_file):
+    cache = cache_path(ecc_file)
+    mtime = os.stat(ecc_file).st_mtime_ns
+    digest = None
+    if os.path.exists(cache):
+        try:
+            with np.load(cache) as cached:
+                if int(cached['version']) == CACHE_VERSION:
+                    if int(cached['mtime']) == mtime:
+                        return EccTable(cached['first_year'], cached['table'])
+                    digest = file_hash(ecc_file)
+                    if str(cached['sha256']) == digest:
+                        ecc = EccTable(cached['first_year'], cached['table'])
+                        save_ecc_table(ecc, cache, mtime, digest)
+                        return ecc
+        except Exception as e:
+            print(f"Ignoring unreadable ECC cache {cache}: {e}")
+
+    ecc = EccTable.from_csv(ecc_file)
+    save_ecc_table(ecc, cache, mtime, digest or file_hash(ecc_file))
+    return ecc
+
+def save_ecc_table(ecc, cache, mtime, digest):
+    try:
+        with open(cache, 'wb') as f:
+            np.savez(f, version=CACHE_VERSION, first_year=ecc.first_year, table=ecc.table, mtime=mtime, sha256=digest)
+    except OSError as e:
+        print(f"Could not write ECC cache {cache}: {e}")
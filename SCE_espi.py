@@ -0,0 +1,119 @@
+# Description: Reads Green Button data in the ESPI Atom/XML format into the interval layout of SCE_parse.py.
+# The feed is read with iterparse and every element is cleared as soon as it has been used, so the XML tree is
+# never held in memory.  The readings are kept until the end of the feed, since an ESPI feed lists each flow
+# direction in full before the next, so memory is O(n) at 24 bytes per reading (under 2 MB for a year of 15 minute
+# readings in both directions).  Each IntervalBlock is linked to its MeterReading and ReadingType by the Atom links,
+# and the ReadingType's flow direction tags its readings as delivered or generated.
+
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+from SCE_parse import combine_repeated, usage_frame
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+ESPI = '{http://naesb.org/espi}'
+# ESPI flow directions: 1 is energy delivered to the customer, 19 is energy received from the customer
+FLOW_TAGS = {1: 'delivered', 19: 'generated'}
+# ESPI readings are Wh (uom 72) scaled by 10 ** powerOfTenMultiplier
+WH_PER_KWH = 1000
+# ESPI times are UTC epoch seconds.  SCE's CSV downloads use Pacific local time, in which the fall-back hour repeats.
+TIMEZONE = 'America/Los_Angeles'
+
+class ReadingType:
+    def __init__(self, tag, scale):
+        self.tag = tag
+        # kwH per unit of IntervalReading value
+        self.scale = scale
+
+def reading_type(element):
+    flow = int(element.findtext(ESPI + 'flowDirection', '1'))
+    multiplier = int(element.findtext(ESPI + 'powerOfTenMultiplier', '0'))
+    if flow not in FLOW_TAGS:
+        print(f"Skipping readings with flow direction {flow}...")
+    return ReadingType(FLOW_TAGS.get(flow), 10.0 ** multiplier / WH_PER_KWH)
+
+# Build the intervals of the readings collected for the IntervalBlocks
+def block_frame(blocks):
+    if not blocks:
+        return usage_frame(np.array([], dtype='datetime64[s]'), np.array([], dtype='datetime64[s]'), np.array([]), [])
+    starts = np.concatenate([block[1] for block in blocks])
+    durations = np.concatenate([block[2] for block in blocks])
+    kwHUsage = np.concatenate([block[3] * block[0].scale for block in blocks])
+    tags = np.concatenate([np.full(len(block[1]), block[0].tag, dtype=object) for block in blocks])
+    keep = kwHUsage != 0
+    local = pd.to_datetime(starts[keep], unit='s', utc=True).tz_convert(TIMEZONE).tz_localize(None)
+    local = local.to_numpy().astype('datetime64[s]')
+    return combine_repeated(usage_frame(local, local + durations[keep].astype('timedelta64[s]'), kwHUsage[keep], tags[keep]))
+
+# Read every interval of an ESPI feed into the compact layout, like read_usage() does for the CSV download.
+# Blocks that come before the ReadingType they refer to are held back until it is found.
+def read_espi(infile):
+    reading_types = {}      # ReadingType self link -> ReadingType
+    meter_readings = {}     # MeterReading self link -> ReadingType self link
+    blocks, pending, retry = [], [], False
+    links, starts, durations, values = {}, [], [], []
+
+    # Keep a block whose ReadingType is known, or return it if the ReadingType has not been read yet
+    def resolve(block):
+        kind = reading_types.get(meter_readings.get(block[0]))
+        if kind is None:
+            return block
+        if kind.tag is not None:
+            blocks.append((kind,) + block[1:])
+        return None
+
+    context = ET.iterparse(infile, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        tag = element.tag
+        if event == 'start':
+            if tag == ATOM + 'entry':
+                links = {}
+            continue
+
+        if tag == ATOM + 'link':
+            links.setdefault(element.get('rel', 'alternate'), []).append(element.get('href', ''))
+        elif tag == ESPI + 'IntervalReading':
+            starts.append(element.findtext(f'{ESPI}timePeriod/{ESPI}start'))
+            durations.append(element.findtext(f'{ESPI}timePeriod/{ESPI}duration'))
+            values.append(element.findtext(ESPI + 'value'))
+            element.clear()
+        elif tag == ESPI + 'IntervalBlock':
+            # The block's self link is <MeterReading self link>/IntervalBlock/<id>
+            self_link = (links.get('self') or links.get('up') or [''])[0]
+            block = (self_link.rsplit('/IntervalBlock', 1)[0], np.array(starts, dtype=np.int64),
+                     np.array(durations, dtype=np.int64), np.array(values, dtype=float))
+            starts, durations, values = [], [], []
+            if resolve(block) is not None:
+                pending.append(block)
+        elif tag == ESPI + 'ReadingType':
+            reading_types[(links.get('self') or [''])[0]] = reading_type(element)
+            retry = True
+        elif tag == ESPI + 'MeterReading':
+            related = [href for href in links.get('related', []) if '/ReadingType/' in href]
+            meter_readings[(links.get('self') or [''])[0]] = related[0] if related else None
+            retry = True
+        elif tag == ATOM + 'entry':
+            root.clear()
+            if retry and pending:
+                pending = [block for block in pending if resolve(block) is not None]
+            retry = False
+
+    # Blocks that never found their ReadingType use the only one in the feed, or count as delivered
+    fallback = next(iter(reading_types.values())) if len(reading_types) == 1 else ReadingType('delivered', 1 / WH_PER_KWH)
+    for block in pending:
+        kind = reading_types.get(meter_readings.get(block[0]), fallback)
+        if kind.tag is not None:
+            blocks.append((kind,) + block[1:])
+    return block_frame(blocks)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the intervals of a Green Button ESPI XML file.")
+    parser.add_argument("input_file", help="Green Button XML file")
+    args = parser.parse_args()
+
+    usage = read_espi(args.input_file)
+    print(usage.groupby('Tag', observed=True)['kwHUsage'].agg(['count', 'sum']).to_string())
+    print(f"{len(usage)} intervals from {usage['Start'].min()} to {usage['Start'].max()}")
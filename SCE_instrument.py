@@ -0,0 +1,153 @@
+# Description: Records the wall time, CPU time, peak RSS and row counts of each pipeline stage.
+# Stages are marked with the @instrumented decorator or the stage() context manager.  They only record anything while a
+# RunReport is active, so the pipeline runs unchanged when nobody is watching.  A report can call a hook after
+# every stage and is saved as JSON; profile() wraps a run in cProfile.
+
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The report stages are recorded into, if any
+ACTIVE_REPORT = None
+
+# Peak resident set size of the process so far, in MB.  ru_maxrss is in KB on Linux and bytes on macOS.
+def peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1e6 if sys.platform == 'darwin' else 1e3), 3)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1e6, 3)
+    except (ImportError, AttributeError):
+        return None
+
+def row_count(value):
+    return len(value) if hasattr(value, '__len__') and not isinstance(value, (str, bytes, os.PathLike)) else None
+
+class RunReport:
+    def __init__(self, hook=None, **details):
+        # hook(record) is called after every stage, including failed ones
+        self.hook = hook
+        self.details = details
+        self.stages = []
+        self.status = None
+        self.error = None
+        self.started = None
+        self.wall = None
+        self.depth = 0
+
+    # A report can be entered again by the stages it runs (process_usage() inside SCE_runall.py); only the
+    # outermost entry times the run.
+    def __enter__(self):
+        global ACTIVE_REPORT
+        self.depth += 1
+        if self.depth == 1:
+            self.started = datetime.datetime.now().isoformat(timespec="seconds")
+            self.wall = time.perf_counter()
+            self.previous, ACTIVE_REPORT = ACTIVE_REPORT, self
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        global ACTIVE_REPORT
+        self.depth -= 1
+        if exc is not None:
+            self.fail(exc)
+        if self.depth == 0:
+            ACTIVE_REPORT = self.previous
+            self.wall = time.perf_counter() - self.wall
+            if self.status is None:
+                self.status = "ok"
+        return False
+
+    def fail(self, error):
+        self.status = "failed"
+        self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+    def record(self, record):
+        self.stages.append(record)
+        if self.hook is not None:
+            self.hook(record)
+
+    # Wall and CPU time per stage name, summed over calls (the streaming pipeline runs each stage once per chunk)
+    def totals(self):
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record["stage"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            total["calls"] += 1
+            total["wall_seconds"] = round(total["wall_seconds"] + record["wall_seconds"], 6)
+            total["cpu_seconds"] = round(total["cpu_seconds"] + record["cpu_seconds"], 6)
+        return totals
+
+    def as_dict(self):
+        return {
+            **self.details,
+            "started": self.started,
+            "status": self.status,
+            "error": self.error,
+            "wall_seconds": round(self.wall, 6) if self.status else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.stages,
+            "totals": self.totals(),
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f_out:
+            json.dump(self.as_dict(), f_out, indent=2, default=str)
+
+# Measure the block as one stage of the active report.  Set "rows_in"/"rows_out" on the yielded record.
+# A stage that raises is recorded as failed and the exception is passed on.
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    report = ACTIVE_REPORT
+    if report is None:
+        yield {}
+        return
+    record = {"stage": name, "status": "ok", "rows_in": rows_in, "rows_out": None}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - wall, 6)
+        record["cpu_seconds"] = round(time.process_time() - cpu, 6)
+        record["peak_rss_mb"] = peak_rss_mb()
+        report.record(record)
+
+# Decorate a stage function.  Rows in are counted from its first argument and rows out from its result.
+def instrumented(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if ACTIVE_REPORT is None:
+                return func(*args, **kwargs)
+            with stage(name, row_count(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = row_count(result)
+            return result
+        return wrapper
+    return decorate
+
+# Run the block under cProfile and save the stats to the given file (view them with python -m pstats)
+@contextlib.contextmanager
+def profile(path):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print("Profile stored in " + path)
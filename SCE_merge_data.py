@@ -1,5 +1,16 @@
+import copy
+import datetime
+import os
+import posixpath
+import re
+import shutil
+import struct
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from xml.sax.saxutils import escape
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
 
 def colnum_string(n):
     string = ""
@@ -12,71 +23,283 @@ def colnum_string(n):
 csv_file_path = "/path/to/sce_usage_parsed.csv"
 xlsx_file_path = "/path/to/SCE Usage Pivot (MASTER).xlsx"
 
+# Optional interval store (see SCE_store.py).  When set, only the hourly rows that have not been merged yet are
+# read from the store instead of the CSV file, so overlapping downloads are not appended twice.
+store_path = None
+
 # Worksheet and table names
 worksheet_name = "sce_usage_parsed"
 table_name = "Table1"
 
-try:
-    # Read CSV data
-    csv_data = pd.read_csv(csv_file_path)
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+# Excel stores dates as days since 1899-12-30
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+# Bytes of the worksheet read at a time
+CHUNK_BYTES = 1 << 20
+SHEET_DATA_PATTERN = re.compile(rb'<((?:\w+:)?)sheetData\b[^>]*?(/?)>')
+ROW_START_PATTERN = re.compile(rb'<(?:\w+:)?row\b')
+ROW_PATTERN = re.compile(rb'<(?:\w+:)?row\b[^>]*?\br="(\d+)"')
+CELL_PATTERN = re.compile(rb'<(?:\w+:)?c\b[^>]*?\br="([A-Z]+)\d+"[^>]*>')
+# General purpose bit 3: the sizes and CRC follow the data instead of being in the local header
+DATA_DESCRIPTOR_FLAG = 0x08
+
+# Read the new rows from the CSV file and normalize the formatting for Excel
+def read_csv_data(csv_data):
     csv_data = csv_data.map(lambda x: x.strip() if isinstance(x, str) else x)
     if 'Date' in csv_data.columns:
         csv_data['Date'] = pd.to_datetime(csv_data['Date']).dt.date
     if 'StartTime' in csv_data.columns and 'EndTime' in csv_data.columns:
-        csv_data['StartTime'] = pd.to_datetime(csv_data['StartTime'], format='%H:%M:%S').dt.time
-        csv_data['EndTime'] = pd.to_datetime(csv_data['EndTime'], format='%H:%M:%S').dt.time
-        csv_data['StartTime'] = csv_data['StartTime'].apply(lambda x: x.strftime('%H:%M'))
-        csv_data['EndTime'] = csv_data['EndTime'].apply(lambda x: x.strftime('%H:%M'))
-    
+        csv_data['StartTime'] = pd.to_datetime(csv_data['StartTime'], format='%H:%M:%S').dt.strftime('%H:%M')
+        csv_data['EndTime'] = pd.to_datetime(csv_data['EndTime'], format='%H:%M:%S').dt.strftime('%H:%M')
+
     if 'kwHUsage' in csv_data.columns and 'Cost' in csv_data.columns:
         csv_data['kwHUsage'] = pd.to_numeric(csv_data['kwHUsage'], errors='coerce')
         csv_data['Cost'] = pd.to_numeric(csv_data['Cost'], errors='coerce')
-    print("Opened CSV file...")
-except Exception as e:
-    print(f"Error reading CSV file: {e}")
-
-try:
-    # Load existing XLSX file
-    workbook = load_workbook(xlsx_file_path)
-
-    # Get the specific worksheet
-    worksheet = workbook[worksheet_name]
-
-    # Identify number formats from existing data
-    number_formats = {}
-    for col_idx, column in enumerate(worksheet.iter_cols(min_col=1, max_col=len(csv_data.columns), min_row=1, max_row=1)):
-        number_formats[col_idx] = column[0].number_format
-
-    # Append CSV data to the bottom of the table
-    for row in csv_data.itertuples(index=False):
-        worksheet.append(row)
-
-    # Apply number formats to the appended data
-    for row_idx, row in enumerate(worksheet.iter_rows(min_row=worksheet.max_row - len(csv_data) + 1, max_row=worksheet.max_row, min_col=1, max_col=len(csv_data.columns))):
-        for col_idx, cell in enumerate(row):
-            cell.number_format = number_formats.get(col_idx, cell.number_format)
-    print("Appended data to XLSX file...")
-except Exception as e:
-    print(f"Error loading XLSX file: {e}")
-
-try:
-    # Expand the table to include the new data
-    tb = worksheet.tables[table_name]
-    current_range = tb.ref
-    start_cell, end_cell = current_range.split(':')
-    start_row = int(start_cell[1:])
-    new_end_cell = f"{colnum_string(len(csv_data.columns))}{worksheet.max_row}"
-    tb.ref = f"{start_cell}:{new_end_cell}"
-    print("Expanded table...")
-except Exception as e:
-    print(f"Error expanding table: {e}")
-
-try:
-    # Save the modified XLSX file
-    workbook.save(xlsx_file_path)
-    workbook.close()
-    print("Workbook saved...")
-    print("Done!")
-except Exception as e:
-    print(f"Error saving XLSX file: {e}")
+    return csv_data
+
+# Return the part name a relationship points to, relative to the part that owns the relationships
+def resolve_target(owner, target):
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(owner), target))
+
+def relationships(package, owner):
+    rels = posixpath.join(posixpath.dirname(owner), '_rels', posixpath.basename(owner) + '.rels')
+    root = ET.fromstring(package.read(rels))
+    return {rel.get('Id'): resolve_target(owner, rel.get('Target')) for rel in root.iter(f'{{{PACKAGE_REL_NS}}}Relationship')}
+
+# Find the sheet and table parts of the workbook package by their names
+def find_parts(package, sheet_name, table):
+    workbook = 'xl/workbook.xml'
+    rels = relationships(package, workbook)
+    for sheet in ET.fromstring(package.read(workbook)).iter():
+        if sheet.tag.endswith('}sheet') and sheet.get('name') == sheet_name:
+            sheet_part = rels[sheet.get(f'{{{REL_NS}}}id')]
+            break
+    else:
+        raise KeyError(f"Worksheet {sheet_name} not found")
+
+    for table_part in relationships(package, sheet_part).values():
+        if table_part in package.namelist():
+            root = ET.fromstring(package.read(table_part))
+            if root.tag.endswith('}table') and (root.get('name') == table or root.get('displayName') == table):
+                return sheet_part, table_part
+    raise KeyError(f"Table {table} not found on worksheet {sheet_name}")
+
+# Render one cell.  Column styles are looked up once per column, not copied cell by cell.
+def cell_xml(ref, value, style):
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return ''
+    if isinstance(value, datetime.datetime):
+        serial = (value - datetime.datetime.combine(EXCEL_EPOCH, datetime.time())).total_seconds() / 86400
+        return f'<c r="{ref}"{style}><v>{serial!r}</v></c>'
+    if isinstance(value, datetime.date):
+        return f'<c r="{ref}"{style}><v>{(value - EXCEL_EPOCH).days}</v></c>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"{style}><v>{value!r}</v></c>'
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+# Return {column letter: ' s="n"'} for the styled cells of a row element
+def row_styles(row):
+    styles = {}
+    for cell in CELL_PATTERN.finditer(row):
+        style = re.search(rb'\bs="(\d+)"', cell.group(0))
+        if style:
+            styles[cell.group(1).decode('ascii')] = f' s="{style.group(1).decode("ascii")}"'
+    return styles
+
+def row_xml(number, values, letters, styles, prefix):
+    cells = ''.join(cell_xml(f'{letter}{number}', value, styles.get(letter, '')) for letter, value in zip(letters, values))
+    row = f'<row r="{number}">{cells}</row>'
+    if prefix:
+        row = re.sub(r'<(/?)(row|c|v|is|t)\b', rf'<\1{prefix}\2', row)
+    return row
+
+# Rewrite the rows of content numbered in replace ({row number: index of the data row}) with the data rows,
+# keeping each row's own cell styles, and record the row number each data row was written to
+def replace_rows(content, replace, values, numbers, letters, prefix):
+    if not replace:
+        return content
+    starts = [row.start() for row in ROW_START_PATTERN.finditer(content)] + [len(content)]
+    parts = [content[:starts[0]]]
+    for start, end in zip(starts, starts[1:]):
+        row = content[start:end]
+        number = ROW_PATTERN.match(row)
+        index = replace.pop(int(number.group(1)), None) if number else None
+        if index is not None:
+            numbers[index] = int(number.group(1))
+            row = row_xml(numbers[index], values[index], letters, row_styles(row), prefix).encode('utf-8')
+        parts.append(row)
+    return b''.join(parts)
+
+# Copy a part into the new package as it is stored, without decompressing and recompressing it
+def copy_raw(package, output, item):
+    package.fp.seek(item.header_offset)
+    header = package.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    package.fp.seek(item.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    info = copy.copy(item)
+    info.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    info.header_offset = output.fp.tell()
+    output.fp.write(info.FileHeader())
+    remaining = item.compress_size
+    while remaining:
+        chunk = package.fp.read(min(remaining, CHUNK_BYTES))
+        output.fp.write(chunk)
+        remaining -= len(chunk)
+    output.filelist.append(info)
+    output.NameToInfo[info.filename] = info
+    output.start_dir = output.fp.tell()
+    output._didModify = True
+
+# Stream the sheet part into the new package with the rows appended before </sheetData>.  A data row with a row
+# number in rows overwrites that row instead.  Returns the last row number, the row number of every data row and the
+# resized table part.  The part is read CHUNK_BYTES at a time: the existing rows go through a temporary file, since
+# the dimension at the top of the sheet can only be resized once the last row is known, so only the sheet's head,
+# one chunk and the last row are held in memory.
+def write_sheet(package, output, item, data, table_xml, rows):
+    values = list(data.itertuples(index=False, name=None))
+    letters = [colnum_string(i + 1) for i in range(len(data.columns))]
+    numbers = [None] * len(values)
+    replace = {int(number): index for index, number in enumerate(rows) if pd.notna(number)}
+    with package.open(item) as source, tempfile.TemporaryFile() as body:
+        chunks = iter(lambda: source.read(CHUNK_BYTES), b'')
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            start = SHEET_DATA_PATTERN.search(head)
+            if start:
+                break
+        else:
+            raise ValueError(f"No sheetData in {item.filename}")
+        prefix = start.group(1).decode('ascii')
+        end_tag = f'</{prefix}sheetData>'.encode('ascii')
+        pending = head[start.end():]
+        if start.group(2):
+            pending = end_tag + pending
+            head = head[:start.start()] + f'<{prefix}sheetData>'.encode('ascii')
+        else:
+            head = head[:start.end()]
+
+        # Copy the complete rows to the temporary file, keeping back the row that may be cut off by the chunk
+        last = b''
+        while True:
+            end = pending.find(end_tag)
+            if end >= 0:
+                break
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError(f"No </sheetData> in {item.filename}")
+            pending += chunk
+            starts = [row.start() for row in ROW_START_PATTERN.finditer(pending)]
+            if len(starts) > 1:
+                body.write(replace_rows(pending[:starts[-1]], replace, values, numbers, letters, prefix))
+                last, pending = pending[starts[-2]:starts[-1]], pending[starts[-1]:]
+        starts = [row.start() for row in ROW_START_PATTERN.finditer(pending, 0, end)]
+        if starts:
+            last = pending[starts[-1]:end]
+        body.write(replace_rows(pending[:end], replace, values, numbers, letters, prefix))
+        pending = pending[end:]
+
+        # The last row number and the cell styles of the last data row
+        row = ROW_PATTERN.match(last)
+        last_row = int(row.group(1)) if row else 0
+        styles = row_styles(last) if last_row > 1 else {}
+        new_rows = []
+        for index in range(len(values)):
+            if numbers[index] is None:
+                last_row += 1
+                numbers[index] = last_row
+                new_rows.append(row_xml(last_row, values[index], letters, styles, prefix))
+        new_rows = ''.join(new_rows)
+
+        # Resize the sheet dimension and Table1 (and its autoFilter) in place
+        last_cell = f'{letters[-1]}{last_row}'
+        head = re.sub(rb'(<(?:\w+:)?dimension\b[^>]*\bref=")([A-Z]+\d+)(?::[A-Z]+\d+)?"', rb'\1\2:' + last_cell.encode('ascii') + rb'"', head, count=1)
+        table_xml = re.sub(r'(<(?:\w+:)?(?:table|autoFilter)\b[^>]*?\bref=")([A-Z]+\d+):[A-Z]+\d+"', rf'\1\2:{last_cell}"', table_xml)
+
+        info = zipfile.ZipInfo(item.filename, item.date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with output.open(info, 'w') as sheet:
+            sheet.write(head)
+            body.seek(0)
+            shutil.copyfileobj(body, sheet, CHUNK_BYTES)
+            sheet.write(new_rows.encode('utf-8'))
+            sheet.write(pending)
+            for chunk in chunks:
+                sheet.write(chunk)
+    return last_row, numbers, table_xml
+
+# Append the rows to the worksheet and grow the table to cover them, and return the last row number.  Only the
+# sheet and table parts are rewritten; the other parts of the package are copied over as they are stored.
+def append_rows(xlsx_path, sheet_name, table, data):
+    return write_rows(xlsx_path, sheet_name, table, data)[0]
+
+# Write the rows to the worksheet: a row with a number in rows overwrites that worksheet row (a row of empty values
+# blanks it), and the others are appended.  Returns the last row number and the row number of every data row.
+def write_rows(xlsx_path, sheet_name, table, data, rows=None):
+    rows = [None] * len(data) if rows is None else list(rows)
+    temp_path = xlsx_path + '.tmp'
+    with zipfile.ZipFile(xlsx_path) as package:
+        sheet_part, table_part = find_parts(package, sheet_name, table)
+        table_xml = package.read(table_part).decode('utf-8')
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as output:
+            # The table part is written right after the sheet, once its new range is known
+            for item in package.infolist():
+                if item.filename == sheet_part:
+                    last_row, numbers, table_xml = write_sheet(package, output, item, data, table_xml, rows)
+                    output.writestr(package.getinfo(table_part), table_xml.encode('utf-8'))
+                elif item.filename != table_part:
+                    copy_raw(package, output, item)
+    os.replace(temp_path, xlsx_path)
+    return last_row, numbers
+
+# Merge new rows into the master workbook.  data is the hourly DataFrame from SCE_parse.process_usage(); without it
+# the rows are read from the store (store, or store_path when it is set) or from the _parsed.csv file.  Rows from the
+# store that revise hours already in the workbook overwrite the rows they were written to.
+def merge_data(data=None, xlsx_path=None, store=None):
+    xlsx_path = xlsx_path or xlsx_file_path
+    store = store or store_path
+    pending = None
+    try:
+        # Read CSV data
+        if data is not None:
+            csv_data = read_csv_data(data)
+        elif store:
+            from SCE_parse import HEADER
+            from SCE_store import pending_hourly
+            pending = pending_hourly(store)
+            if pending.empty:
+                print("No unexported rows in the store...")
+                return 0
+            csv_data = read_csv_data(pending[HEADER])
+        else:
+            csv_data = read_csv_data(pd.read_csv(csv_file_path))
+        print("Opened CSV file...")
+    except Exception as e:
+        print(f"Error reading CSV file: {e}")
+        return None
+
+    try:
+        if pending is None:
+            # Append CSV data to the bottom of the table and expand the table to include it
+            last_row = append_rows(xlsx_path, worksheet_name, table_name, csv_data)
+            print(f"Appended data to XLSX file and expanded table to row {last_row}...")
+        else:
+            from SCE_store import mark_exported
+            last_row, numbers = write_rows(xlsx_path, worksheet_name, table_name, csv_data, pending['xlsx_row'])
+            replaced = int(pending['xlsx_row'].notna().sum())
+            print(f"Replaced {replaced} revised rows, appended {len(pending) - replaced} rows and expanded table to row {last_row}...")
+            mark_exported(pending.assign(xlsx_row=numbers), store)
+        print("Done!")
+        return last_row
+    except Exception as e:
+        print(f"Error updating XLSX file: {e}")
+        return None
 
+if __name__ == "__main__":
+    merge_data()
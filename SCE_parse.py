@@ -1,10 +1,17 @@
 # Description: This script parses the data from the SCE usage file and writes it to a new file.
 
-import csv
-import datetime
+import argparse
+import contextlib
+import os
+import sys
+import numpy as np
 import pandas as pd
 import warnings
 
+from SCE_ecc import load_ecc_table
+from SCE_instrument import RunReport, instrumented, profile, stage
+from SCE_tariff import Tariff, load_tariff
+
 # Constants
 MONTH_MAP = {
     "01": "January", "02": "February", "03": "March", "04": "April", "05": "May",
@@ -22,6 +29,9 @@ BILLING_SEASON_MAP = {
     "May": "Winter", "June": "Summer", "July": "Summer", "August": "Summer",
     "September": "Summer", "October": "Winter", "November": "Winter", "December": "Winter"
 }
+# Day numbers follow pandas (Monday is 0), so this map bills Mondays as weekend days and Saturdays as weekdays.
+# It is kept as it has always been so the _parsed.csv output does not change; the tariff files in tariffs/,
+# TOU-D-PRIME.json included, map 5 and 6 (Saturday and Sunday) to Weekend.
 WEEKDAY_MAP = {
     0: "Weekend", 1: "Weekday", 2: "Weekday", 3: "Weekday", 4: "Weekday",
     5: "Weekday", 6: "Weekend"
@@ -34,6 +44,19 @@ DELIVERY_COSTS = {
     ("Summer", "Weekday", "Off-Peak"): 0.26, ("Summer", "Weekday", "On-Peak"): 0.63,
     ("Summer", "Weekend", "Mid-Peak"): 0.39, ("Summer", "Weekend", "Off-Peak"): 0.26
 }
+# TOU periods of SCE's TOU-D-Prime rate schedule.  Other tariffs can be loaded with load_tariff().
+TOU_D_PRIME = Tariff(
+    name="TOU-D-Prime",
+    seasons=BILLING_SEASON_MAP,
+    day_types=WEEKDAY_MAP,
+    periods=[
+        ("Winter", None, "08:00", "16:00", "Super-Off-Peak"),
+        ("Winter", None, "16:00", "21:00", "Mid-Peak"),
+        ("Summer", "Weekend", "16:00", "21:00", "Mid-Peak"),
+        ("Summer", "Weekday", "16:00", "21:00", "On-Peak"),
+    ],
+    rates=DELIVERY_COSTS,
+)
 
 # SCE offers an EEC bonus for customers that enroll in the first year of the Solar Billing Program.  Set to 0 if this if not applicable.
 BONUS = 0.04
@@ -41,72 +64,503 @@ BONUS = 0.04
 # Pandas will throw a future warning when injecting unsupport dtypes into a dataframe.  This is intended to suppress that warning.
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+HEADER = ["Date", "StartTime", "EndTime", "kwHUsage", "Tag", "Season", "Year", "Month", "BillingSeason", "BillingDay", "TOU", "Cost"]
+
+# Modify the the path to the ECC data file
+ECC_FILE = '/path/to/ECC_data.csv'
+
+# The stages pass intervals around in a compact typed layout: the interval start and its length in minutes,
+# float32 usage and categorical labels.  Strings are only rendered in the HEADER layout by format_frame().
+COLUMNS = ["Start", "Minutes", "kwHUsage", "Tag", "Season", "Year", "Month", "BillingSeason", "BillingDay", "TOU", "Cost"]
+TAG_DTYPE = pd.CategoricalDtype(["delivered", "generated"])
+MONTH_DTYPE = pd.CategoricalDtype(list(MONTH_MAP.values()))
+SEASON_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(SEASON_MAP.values())))
+# Season code of each month number (index 0 is unused)
+MONTH_SEASON = np.array([0] + [SEASON_DTYPE.categories.get_loc(SEASON_MAP[month]) for month in MONTH_DTYPE.categories])
+# SCE reports usage to at most three decimals, so float32 usage is rounded back to this many decimals for arithmetic
+USAGE_DECIMALS = 6
+
 # Define and write the header row to the output file
 def write_header(outfile):
-    header = ["Date", "StartTime", "EndTime", "kwHUsage", "Tag", "Season", "Year", "Month", "BillingSeason", "BillingDay", "TOU", "Cost"]
-    df = pd.DataFrame(columns=header)
+    df = pd.DataFrame(columns=HEADER)
     df.to_csv(outfile, index=False)
     print("Header row written...")
 
+# Section headers name the type of reading in their first field, e.g. "Energy Delivered time period"
+SECTION_WORDS = {b'Received': 'generated', b'Delivered': 'delivered', b'Consumption': 'delivered'}
+# SCE writes this row instead of interval data when the download is empty
+EMPTY_FILE_MARKER = b"0NaN-NaN-NaN NaN:NaN:00"
+# Interval rows start with "YYYY-MM-DD HH:MM:SS", and the end of the interval is the 19 characters before the first comma
+TIMESTAMP_WIDTH = 19
+
+def is_espi(infile):
+    return str(infile).lower().endswith('.xml')
+
+# Offsets of the digits in "YYYY-MM-DD HH:MM:SS"
+TIMESTAMP_DIGITS = np.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18])
+# Interval rows read "<start><space>to <end>,<usage>,<quality>", where the space is one to four bytes (a space, a
+# UTF-8 non-breaking space or its mojibake), so the first comma is looked for in this many bytes from the shortest
+# row layout on.  Rows with the comma anywhere else are searched one by one.
+FIRST_COMMA_OFFSET = 2 * TIMESTAMP_WIDTH + 3
+FIRST_COMMA_WIDTH = 9
+# Usage fields shorter than this are decoded arithmetically; longer ones are handed to float()
+USAGE_WIDTH = 8
+POWERS_OF_TEN = 10 ** np.arange(USAGE_WIDTH, dtype=np.int32)
+# Bytes of each row searched for a section header's first field
+HEADER_WIDTH = 128
+
+# Return the width bytes at each offset as an (offsets, width) array.  The rows are gathered as fixed-width byte
+# strings through a strided view of the buffer, which is much cheaper than indexing every byte.
+def byte_windows(buf, offsets, width):
+    strings = np.ndarray(shape=(len(buf) - width + 1,), dtype=f'S{width}', buffer=buf, strides=(1,))
+    return strings[offsets].view(np.uint8).reshape(len(offsets), width)
+
+# Read the "YYYY-MM-DD HH:MM:SS" timestamps that start at the given offsets as datetime64 values, and whether each
+# one is made of digits.  The digits are combined arithmetically and the date is turned into days since 1970 with
+# the civil-calendar formula, counting the year from March so the leap day comes last.
+def decode_timestamps(buf, offsets):
+    digits = (byte_windows(buf, offsets, TIMESTAMP_WIDTH)[:, TIMESTAMP_DIGITS] - np.uint8(ord('0'))).T.astype(np.int32)
+    valid = (digits <= 9).all(axis=0)
+    year = digits[0] * 1000 + digits[1] * 100 + digits[2] * 10 + digits[3]
+    month = digits[4] * 10 + digits[5]
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + digits[6] * 10 + digits[7] - 1
+    days = era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+    seconds = (digits[8] * 10 + digits[9]) * 3600 + (digits[10] * 10 + digits[11]) * 60 + digits[12] * 10 + digits[13]
+    return (days.astype(np.int64) * 86400 + seconds).astype('datetime64[s]'), valid
+
+# Read the usage field that starts at each offset, up to the next comma or the end of the line.  Plain decimals
+# ("0.13", "-1.2", "4") are decoded one byte column at a time into an integer mantissa, which is divided by a power
+# of ten so it rounds exactly like float(); any other field is passed to float().
+def decode_usage(text, buf, starts):
+    window = np.ascontiguousarray(byte_windows(buf, starts, USAGE_WIDTH).T)
+    mantissa = np.zeros(len(starts), dtype=np.int32)
+    decimals = np.zeros(len(starts), dtype=np.int8)
+    negative = window[0] == ord('-')
+    done = np.zeros(len(starts), dtype=bool)
+    dot = np.zeros(len(starts), dtype=bool)
+    plain = np.ones(len(starts), dtype=bool)
+    any_digit = np.zeros(len(starts), dtype=bool)
+    for column, byte in enumerate(window):
+        done |= (byte == ord(',')) | (byte <= ord('\r'))
+        digit = byte - np.uint8(ord('0'))
+        is_digit = (digit <= 9) & ~done
+        is_dot = (byte == ord('.')) & ~done
+        mantissa = np.where(is_digit, mantissa * 10 + digit, mantissa)
+        decimals += is_digit & dot
+        plain &= done | is_digit | (is_dot & ~dot) | (negative if column == 0 else False)
+        dot |= is_dot
+        any_digit |= is_digit
+    # Fields that fill the whole window, and fields without a digit, are left to float()
+    plain &= done & any_digit
+    kwHUsage = np.where(negative, -mantissa, mantissa) / POWERS_OF_TEN[decimals]
+    for row in np.flatnonzero(~plain).tolist():
+        start = int(starts[row])
+        end = min(position for position in (text.find(b',', start), text.find(b'\n', start), len(text)) if position >= 0)
+        kwHUsage[row] = float(text[start:end])
+    return kwHUsage
+
+# Find the section headers and interval rows of the usage file in one scan over its bytes, then slice the
+# timestamps and usage out of every interval row at once.  Returns the Start, Minutes, kwHUsage and Tag columns
+# of the compact layout.  Zero usage rows are dropped, and an empty download gives an empty frame.
+# Green Button XML (.xml) files are read by SCE_espi.py into the same layout.
+def read_usage(infile):
+    if is_espi(infile):
+        from SCE_espi import read_espi
+        return read_espi(infile)
+    with open(infile, 'rb') as f_in:
+        return parse_usage(f_in.read())
+
+# Parse the bytes of a usage file, or of a run of its sections, the same way as read_usage()
+def parse_usage(text):
+    padding = max(FIRST_COMMA_OFFSET + FIRST_COMMA_WIDTH + USAGE_WIDTH, HEADER_WIDTH)
+    buf = np.frombuffer(text + b'\0' * padding, dtype=np.uint8)
+    size = len(text)
+
+    line_ends = np.flatnonzero(buf[:size] == ord('\n'))
+    if size and text[-1:] != b'\n':
+        line_ends = np.append(line_ends, size)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))[:len(line_ends)]
+
+    # Interval rows: a timestamp at the start of the line and another one before the first comma
+    interval = (buf[line_starts] - np.uint8(ord('0')) <= 9) & (buf[line_starts + 4] == ord('-')) & (buf[line_starts + 13] == ord(':'))
+    lines = np.flatnonzero(interval)
+    # Rows almost always have their first comma where the first row has it; the others are searched in a window
+    first_commas = np.full(len(lines), -1)
+    if len(lines):
+        first = int(line_starts[lines[0]])
+        first_commas = line_starts[lines] + (text.find(b',', first, int(line_ends[lines[0]])) - first)
+    missed = np.flatnonzero((buf[first_commas] != ord(',')) | (first_commas >= line_ends[lines]))
+    if len(missed):
+        window = byte_windows(buf, line_starts[lines[missed]] + FIRST_COMMA_OFFSET, FIRST_COMMA_WIDTH)
+        room = np.clip(line_ends[lines[missed]] - line_starts[lines[missed]] - FIRST_COMMA_OFFSET, 0, FIRST_COMMA_WIDTH)
+        hits = (window == ord(',')) & (np.arange(FIRST_COMMA_WIDTH) < room[:, None])
+        first_commas[missed] = np.where(hits.any(axis=1), line_starts[lines[missed]] + FIRST_COMMA_OFFSET + hits.argmax(axis=1), -1)
+    # A comma found at the guess or in the window is only the first one if no comma comes after the two timestamps
+    # and before it, e.g. in a row whose separator is shorter than the first row's
+    early = first_commas - line_starts[lines] - 2 * TIMESTAMP_WIDTH
+    if len(lines) and early.max() > 0:
+        before = byte_windows(buf, line_starts[lines] + 2 * TIMESTAMP_WIDTH, int(early.max()))
+        first_commas[((before == ord(',')) & (np.arange(before.shape[1]) < early[:, None])).any(axis=1)] = -1
+    for i in np.flatnonzero(first_commas < 0).tolist():
+        first_commas[i] = text.find(b',', int(line_starts[lines[i]]), int(line_ends[lines[i]]))
+    ends = np.maximum(first_commas - TIMESTAMP_WIDTH, 0)
+    matched = (ends >= line_starts[lines] + TIMESTAMP_WIDTH) & (buf[ends + 4] == ord('-')) & (buf[ends + 13] == ord(':'))
+    interval[lines[~matched]] = False
+    lines, first_commas = lines[matched], first_commas[matched]
+
+    # Section headers: a non-interval row with "Received", "Delivered" or "Consumption" in its first field.
+    # "Received" wins when a header names more than one type.  The first HEADER_WIDTH bytes of every other row are
+    # searched at once; a row whose first field runs past them is read on its own.
+    others = np.flatnonzero(~interval)
+    lengths = line_ends[others] - line_starts[others]
+    starts = np.ndarray(shape=(len(buf) - HEADER_WIDTH + 1,), dtype=f'S{HEADER_WIDTH}', buffer=buf, strides=(1,))[line_starts[others]]
+    commas = np.char.find(starts, b',')
+    field_ends = np.where((commas >= 0) & (commas < lengths), commas, np.minimum(lengths, HEADER_WIDTH))
+    tags = np.full(len(others), -1)
+    for word, tag in reversed(SECTION_WORDS.items()):
+        found = np.char.find(starts, word)
+        tags[(found >= 0) & (found + len(word) <= field_ends)] = TAG_DTYPE.categories.get_loc(tag)
+    for i in np.flatnonzero((field_ends == HEADER_WIDTH) & (lengths > HEADER_WIDTH)).tolist():
+        start, end = int(line_starts[others[i]]), int(line_ends[others[i]])
+        comma = text.find(b',', start, end)
+        field = text[start:comma if comma >= 0 else end]
+        tags[i] = next((TAG_DTYPE.categories.get_loc(tag) for word, tag in SECTION_WORDS.items() if word in field), -1)
+    header_lines, header_tags = others[tags >= 0], tags[tags >= 0].astype(np.int8)
+
+    section = np.searchsorted(header_lines, lines, side='right') - 1
+    inside = section >= 0
+    lines, first_commas, section = lines[inside], first_commas[inside], section[inside]
+    if len(lines) == 0:
+        if EMPTY_FILE_MARKER in text:
+            print("No data in the SCE_Usage.csv file.")
+        return usage_frame(np.array([], dtype='datetime64[s]'), np.array([], dtype='datetime64[s]'), np.array([]), [])
+
+    # Usage: the field after the first comma, up to the next comma or the end of the line
+    kwHUsage = decode_usage(text, buf, first_commas + 1)
+    keep = kwHUsage != 0
+    lines, first_commas, section = lines[keep], first_commas[keep], section[keep]
+    starts, valid_starts = decode_timestamps(buf, line_starts[lines])
+    ends, valid_ends = decode_timestamps(buf, first_commas - TIMESTAMP_WIDTH)
+    if not (valid_starts & valid_ends).all():
+        bad = int(lines[np.argmin(valid_starts & valid_ends)])
+        raise ValueError(f"Bad timestamp in usage row: {text[line_starts[bad]:line_ends[bad]]!r}")
+    return usage_frame(starts, ends, kwHUsage[keep], pd.Categorical.from_codes(header_tags[section], dtype=TAG_DTYPE))
+
+# Build intervals in the compact layout from their start and end times, usage and tags
+def usage_frame(starts, ends, kwHUsage, tags):
+    starts = np.asarray(starts, dtype='datetime64[s]')
+    minutes = (np.asarray(ends, dtype='datetime64[s]') - starts).astype('timedelta64[m]').astype(np.int16)
+    return pd.DataFrame({
+        "Start": starts,
+        "Minutes": minutes,
+        "kwHUsage": np.asarray(kwHUsage, dtype=np.float32),
+        "Tag": pd.Categorical(tags, dtype=TAG_DTYPE),
+    })
+
+# Return the usage as float64 without the float32 rounding error
+def usage_kwh(data):
+    return np.round(data['kwHUsage'].to_numpy(dtype=float), USAGE_DECIMALS)
+
+# Sum the readings that share a start, length and tag.  In local time the hour the clocks go back in the fall is
+# repeated, so a feed keyed on UTC has two readings for each of its intervals; keeping them as one interval keeps
+# the starts unique (the interval store's key) and the energy of both in that hour.
+def combine_repeated(usage):
+    keys = ['Start', 'Minutes', 'Tag']
+    if not usage.duplicated(keys).any():
+        return usage
+    combined = usage[keys].assign(kwHUsage=usage_kwh(usage)).groupby(keys, sort=False, observed=True, as_index=False)['kwHUsage'].sum()
+    starts = combined['Start'].to_numpy()
+    return usage_frame(starts, starts + combined['Minutes'].to_numpy().astype('timedelta64[m]'), combined['kwHUsage'], combined['Tag'])
+
+# Render timestamps as date or time strings.  Each distinct date and time of day is formatted only once.
+def format_dates(stamps):
+    codes, uniques = pd.factorize(stamps.dt.normalize())
+    return np.asarray(uniques.strftime('%Y-%m-%d'), dtype=object)[codes]
+
+def format_times(stamps):
+    codes, uniques = pd.factorize(stamps - stamps.dt.normalize())
+    return np.asarray((pd.Timestamp(0) + uniques).strftime('%H:%M:%S'), dtype=object)[codes]
+
+# Read the interval rows from the SCE usage file in the compact layout.
+# Each stage below takes and returns a DataFrame so the whole chain can run in memory.
+@instrumented("parse")
+def parse_frame(infile):
+    return read_usage(infile)
+
+# Render intervals in the HEADER layout of the _parsed.csv file.  Only the columns the stages have filled are
+# rendered, so the output of parse_frame() gives the five columns parse_data() always wrote.
+def format_frame(data):
+    starts = data['Start']
+    output = {
+        "Date": format_dates(starts),
+        "StartTime": format_times(starts),
+        "EndTime": format_times(starts + pd.to_timedelta(data['Minutes'].astype(np.int64), unit='m')),
+        "kwHUsage": usage_kwh(data),
+    }
+    for column in HEADER[4:]:
+        if column in data.columns:
+            values = data[column]
+            output[column] = values.astype(object).to_numpy() if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+    return pd.DataFrame(output, index=data.index)
+
+# Read intervals back from the HEADER layout of the _parsed.csv file into the compact layout
+def compact_frame(data):
+    times = pd.to_datetime(data['StartTime'], format='%H:%M:%S')
+    ends = pd.to_datetime(data['EndTime'], format='%H:%M:%S')
+    starts = pd.to_datetime(data['Date']) + (times - times.dt.normalize())
+    output = usage_frame(starts, starts + (ends - times) % pd.Timedelta(days=1), data['kwHUsage'], data['Tag'])
+    output.index = data.index
+    if 'Season' in data.columns and data['Season'].notna().any():
+        output['Season'] = pd.Categorical(data['Season'], dtype=SEASON_DTYPE)
+        output['Year'] = data['Year'].astype(np.int16)
+        output['Month'] = pd.Categorical(data['Month'], dtype=MONTH_DTYPE)
+        for column in ['BillingSeason', 'BillingDay', 'TOU']:
+            output[column] = data[column].astype('category')
+    if 'Cost' in data.columns:
+        output['Cost'] = data['Cost'].astype(float)
+    return output
+
+# Add the season, year, month and TOU columns.  The billing season, billing day and TOU period come from the tariff.
+@instrumented("enrich")
+def enrich_frame(data, tariff=TOU_D_PRIME):
+    data = data.reindex(columns=COLUMNS)
+    starts = pd.DatetimeIndex(data['Start'])
+    months = starts.month.to_numpy()
+    data['Month'] = pd.Categorical.from_codes(months - 1, dtype=MONTH_DTYPE)
+    data['Year'] = starts.year.to_numpy().astype(np.int16)
+    data['Season'] = pd.Categorical.from_codes(MONTH_SEASON[months], dtype=SEASON_DTYPE)
+    labels = tariff.classify(starts)
+    for column in labels.columns:
+        data[column] = labels[column].array
+    data['Cost'] = data['Cost'].astype(float)
+    return data
+
+# Subtract the generated from delivered kwH to get the net usage.
+# The generated rows are keyed on the interval start and length and joined onto the delivered rows in one pass.
+# Intervals with only a delivered or only a generated row keep their usage unchanged.
+@instrumented("normalize")
+def normalize_frame(data):
+    data = data.copy()
+    keys = ['Start', 'Minutes']
+
+    # Create a mask for the 'delivered' and 'generated' rows
+    delivered_mask = (data['Tag'] == 'delivered').to_numpy()
+    generated_mask = (data['Tag'] == 'generated').to_numpy()
+    kwHUsage = usage_kwh(data)
+
+    # Only the first generated row of an interval is netted against the delivered row
+    generated = pd.Series(kwHUsage[generated_mask], index=pd.MultiIndex.from_frame(data.loc[generated_mask, keys]))
+    generated = generated[~generated.index.duplicated()]
+    delivered_keys = pd.MultiIndex.from_frame(data.loc[delivered_mask, keys])
+    generated_kwh = generated.reindex(delivered_keys).fillna(0).to_numpy()
+
+    # Subtract the generated 'kwHUsage' from the delivered 'kwHUsage'
+    kwHUsage[delivered_mask] = np.round(kwHUsage[delivered_mask] - generated_kwh, USAGE_DECIMALS)
+    data['kwHUsage'] = kwHUsage.astype(np.float32)
+    return data
+
+# Add the delivery cost based on the tariff's rate for each interval
+@instrumented("delivery_cost")
+def delivery_cost_frame(data, tariff=TOU_D_PRIME):
+    data = data.copy()
+    rates = tariff.rate(data['Start'])
+    data['Cost'] = np.where(data['Tag'] == 'delivered', usage_kwh(data) * rates, 0)
+    return data
+
+# Add the received value of the generated kwH from the ECC data.
+# ecc_file is either the path to the ECC data file or an already compiled EccTable.
+# Generated intervals without an ECC factor keep a value of 0 and are reported by year and month.
+@instrumented("received_value")
+def received_value_frame(data, ecc_file=ECC_FILE):
+    data = data.copy()
+    ecc = load_ecc_table(ecc_file) if isinstance(ecc_file, (str, os.PathLike)) else ecc_file
+
+    generated_mask = (data['Tag'] == 'generated').to_numpy()
+    if not generated_mask.any():
+        return data
+    generated = data[generated_mask]
+
+    # The ECC data counts hours from 1 to 24
+    starts = pd.DatetimeIndex(generated['Start'])
+    hours = np.where(starts.hour == 0, 24, starts.hour)
+    months = starts.month.to_numpy()
+    years = generated['Year'].to_numpy()
+    weekend = (generated['BillingDay'] == 'Weekend').to_numpy()
+    factors = ecc.lookup(years, months, hours, weekend)
+
+    missing = np.isnan(factors)
+    if missing.any():
+        periods = sorted({(int(y), int(m)) for y, m in zip(years[missing], months[missing])})
+        print("No ECC data for " + ", ".join(f"{y}-{m:02}" for y, m in periods) + "; generated value left at 0.")
+
+    kwHUsage = usage_kwh(generated)
+    value = kwHUsage * (factors + kwHUsage * BONUS)
+    cost = data['Cost'].to_numpy(dtype=float, copy=True)
+    cost[np.flatnonzero(generated_mask)[~missing]] = value[~missing]
+    data['Cost'] = cost
+    return data
+
+# Consolidate the SBP's 15 minute blocks of time into single hour blocks
+@instrumented("combine")
+def combine_frame(data):
+    hours = pd.DatetimeIndex(data['Start']).floor('h')
+    grouped = data.assign(Start=hours, kwHUsage=usage_kwh(data)).groupby(['Start', 'Tag'], sort=True, observed=True)
+    sums = grouped[['kwHUsage', 'Cost']].sum()
+    firsts = grouped[['Season', 'Year', 'Month', 'BillingSeason', 'BillingDay', 'TOU']].first()
+    output = pd.concat([sums, firsts], axis=1).reset_index()
+    output['Minutes'] = np.int16(60)
+    output['kwHUsage'] = np.round(output['kwHUsage'], USAGE_DECIMALS).astype(np.float32)
+    for column in ['Season', 'Month', 'BillingSeason', 'BillingDay', 'TOU']:
+        output[column] = output[column].astype(data[column].dtype)
+    return output[COLUMNS]
+
+# Write the output file through a temporary file, so a failed run never leaves a half-written _parsed.csv behind
+def write_output(data, outfile):
+    with stage("write", len(data)) as record:
+        data.to_csv(outfile + '.tmp', index=False, encoding='utf-8')
+        os.replace(outfile + '.tmp', outfile)
+        record["rows_out"] = len(data)
+
+# Hand the hourly rows in the compact layout to each extra writer, e.g. {"parquet": partial(write_dataset, ...)}
+# (see SCE_dataset.py).  The _parsed.csv file is always written as well.
+def write_extra(data, writers):
+    for name, writer in (writers or {}).items():
+        with stage("write_" + name, len(data)) as record:
+            writer(data)
+            record["rows_out"] = len(data)
+
+# Run every stage in memory and write the output file once at the end.  Returns the rows as written.
+# Each stage is recorded in the report (see SCE_instrument.py), which also keeps the status of the run.
+def process_usage(infile, outfile, ecc_file=ECC_FILE, tariff=TOU_D_PRIME, report=None, writers=None):
+    report = report or RunReport(input=infile, output=outfile)
+    try:
+        with report:
+            data = parse_frame(infile)
+            if data.empty:
+                data = pd.DataFrame(columns=HEADER)
+                write_output(data, outfile)
+                return data
+            print("Primary data parsing complete...")
+            data = enrich_frame(data, tariff)
+            print("Data enrichment complete...")
+            data = normalize_frame(data)
+            print("Net usage calculated...")
+            data = delivery_cost_frame(data, tariff)
+            print("Delivery cost added...")
+            data = received_value_frame(data, ecc_file)
+            print("Generated value added...")
+            data = combine_frame(data)
+            print("Data combined...")
+            write_extra(data, writers)
+            data = format_frame(data)
+            write_output(data, outfile)
+            return data
+    except Exception as e:
+        print(f"Error processing {infile}: {e}")
+
+# Every "Data for period starting" line opens a section of interval rows
+PERIOD_MARKER = b"Data for period starting:"
+
+# Index the period sections of the usage file as (period start, byte offset, length) without loading it
+def index_periods(infile):
+    periods = []
+    offset = 0
+    with open(infile, 'rb') as f_in:
+        for line in f_in:
+            if line.startswith(PERIOD_MARKER):
+                if periods:
+                    periods[-1][2] = offset - periods[-1][1]
+                periods.append([line[len(PERIOD_MARKER):].strip()[:TIMESTAMP_WIDTH], offset, None])
+            offset += len(line)
+    if periods:
+        periods[-1][2] = offset - periods[-1][1]
+    return periods
+
+# Yield the interval rows of the usage file chunk_periods periods at a time, in chronological order.
+# The delivered and received sections of a period always land in the same chunk, wherever they are in the file.
+# An ESPI feed lists each flow direction in full before the next, so it is read as one chunk.
+def stream_usage(infile, chunk_periods=31):
+    if is_espi(infile):
+        with stage("parse") as record:
+            data = read_usage(infile)
+            record["rows_out"] = len(data)
+        if not data.empty:
+            yield data
+        return
+    periods = sorted(index_periods(infile), key=lambda period: period[0])
+    starts = sorted({period[0] for period in periods})
+    with open(infile, 'rb') as f_in:
+        for first in range(0, len(starts), chunk_periods):
+            chunk = set(starts[first:first + chunk_periods])
+            parts = []
+            for start, offset, length in periods:
+                if start in chunk:
+                    f_in.seek(offset)
+                    parts.append(f_in.read(length))
+            with stage("parse", len(parts)) as record:
+                data = parse_usage(b"".join(parts))
+                record["rows_out"] = len(data)
+            if not data.empty:
+                yield data
+
+# Yield the hourly output of the usage file chunk by chunk.  Every stage runs on one chunk at a time, so memory
+# is bounded by chunk_periods rather than by the size of the file.  SCE's periods start on the hour, so no
+# hourly block is split between chunks and the rows match process_usage().
+def process_stream(infile, ecc_file=ECC_FILE, tariff=TOU_D_PRIME, chunk_periods=31):
+    ecc = load_ecc_table(ecc_file) if isinstance(ecc_file, (str, os.PathLike)) else ecc_file
+    for usage in stream_usage(infile, chunk_periods):
+        yield process_frame(usage, ecc, tariff)
+
+# Run every stage after parsing on intervals from read_usage() and return the hourly rows in the compact layout
+def process_frame(usage, ecc_file=ECC_FILE, tariff=TOU_D_PRIME):
+    data = enrich_frame(usage, tariff)
+    data = normalize_frame(data)
+    data = delivery_cost_frame(data, tariff)
+    data = received_value_frame(data, ecc_file)
+    return combine_frame(data)
+
+# Run the streaming pipeline and append each chunk to a temporary file as soon as it is ready.
+# The temporary file replaces the output file once every chunk has been written.
+def process_usage_stream(infile, outfile, ecc_file=ECC_FILE, tariff=TOU_D_PRIME, chunk_periods=31, report=None, writers=None):
+    report = report or RunReport(input=infile, output=outfile)
+    try:
+        with report:
+            pd.DataFrame(columns=HEADER).to_csv(outfile + '.tmp', index=False)
+            rows = 0
+            for data in process_stream(infile, ecc_file, tariff, chunk_periods):
+                write_extra(data, writers)
+                with stage("write", len(data)) as record:
+                    data = format_frame(data)
+                    data.to_csv(outfile + '.tmp', mode='a', header=False, index=False, encoding='utf-8')
+                    record["rows_out"] = len(data)
+                rows += len(data)
+            os.replace(outfile + '.tmp', outfile)
+            print(f"{rows} rows written to {outfile}...")
+    except Exception as e:
+        print(f"Error processing {infile}: {e}")
+
+# The functions below keep the original file-to-file interface.  Each one reads the output file,
+# runs the matching stage and writes the result back.
+
+def read_output(outfile):
+    return compact_frame(pd.read_csv(outfile, encoding='utf-8'))
+
 # Parse the data from the input file and write it to the output file
 def parse_data(infile, outfile):
-    data_rows = []
     try:
-        with open(infile, 'r', newline='', encoding='utf-8') as f_in:
-            reader = csv.reader(f_in)
-            tag = ''
-            for row in reader:
-                if not row:
-                    continue
-                if 'Received' in row[0]:
-                    tag = 'generated'
-                elif 'Delivered' in row[0] or 'Consumption' in row[0]:
-                    tag = 'delivered'
-                elif 'to' in row[0]:
-                    kwHUsage = float(row[1])
-                    parse_row = row[0].split('to')
-                    parse_row = [item.replace('Â\xa0', '') for item in parse_row]
-                    start = parse_row[0].split(' ')
-                    date = start[0].strip()
-                    startTime = start[1].strip()
-                    end = parse_row[1].split(' ')
-                    endTime = end[2].strip()
-                    if kwHUsage != 0:
-                        data_rows.append([date, startTime, endTime, kwHUsage, tag])
-                elif "0NaN-NaN-NaN NaN:NaN:00Â\xa0 for NaN" in row[0]:
-                     print("No data in the SCE_Usage.csv file.")
-                     exit()
-        df = pd.DataFrame(data_rows, columns=["Date", "StartTime", "EndTime", "kwHUsage", "Tag"])
+        df = format_frame(parse_frame(infile))
         df.to_csv(outfile, mode='a', header=False, index=False, encoding='utf-8')
         print("Primary data parsing complete...")
     except Exception as e:
         print(f"Error parsing data: {e}")
 
 # Add the month and year to the output file
-def enrich_data(outfile):
+def enrich_data(outfile, tariff=TOU_D_PRIME):
     try:
-        data = pd.read_csv(outfile, encoding='utf-8')
-        data['Date'] = pd.to_datetime(data['Date'])
-        data['Month'] = data['Date'].dt.strftime('%m').map(MONTH_MAP)
-        data['Year'] = data['Date'].dt.year
-        data['Season'] = data['Month'].map(SEASON_MAP)
-        data['BillingSeason'] = data['Month'].map(BILLING_SEASON_MAP)
-        data['BillingDay'] = data['Date'].dt.weekday.map(WEEKDAY_MAP)
-        
-        # Add TOU
-        data['TOU'] = 'Off-Peak'
-        winter_mask = data['BillingSeason'] == 'Winter'
-        summer_mask = data['BillingSeason'] == 'Summer'
-        weekday_mask = data['BillingDay'] == 'Weekday'
-        weekend_mask = data['BillingDay'] == 'Weekend'
-        
-        data.loc[winter_mask & (data['StartTime'] >= '21:00:00') & (data['EndTime'] <= '08:00:00'), 'TOU'] = 'Off-Peak'
-        data.loc[winter_mask & (data['StartTime'] >= '16:00:00') & (data['EndTime'] <= '21:00:00'), 'TOU'] = 'Mid-Peak'
-        data.loc[winter_mask & (data['StartTime'] >= '08:00:00') & (data['EndTime'] <= '16:00:00'), 'TOU'] = 'Super-Off-Peak'
-        data.loc[summer_mask & weekend_mask & (data['StartTime'] >= '16:00:00') & (data['EndTime'] <= '21:00:00'), 'TOU'] = 'Mid-Peak'
-        data.loc[summer_mask & weekday_mask & (data['StartTime'] >= '16:00:00') & (data['EndTime'] <= '21:00:00'), 'TOU'] = 'On-Peak'
-        data.loc[winter_mask & ((data['StartTime'] >= '23:00:00') | (data['StartTime'] < '00:00:00')), 'TOU'] = 'Off-Peak'
-        
+        data = format_frame(enrich_frame(read_output(outfile), tariff))
         data.to_csv(outfile, index=False)
         print("Data enrichment complete...")
     except Exception as e:
@@ -115,39 +569,8 @@ def enrich_data(outfile):
 # subtract the generated from delivered khw to get the net usage
 def normalize_kwh(outfile):
     try:
-        # Load the data
-        data = pd.read_csv(outfile, encoding='utf-8')
-        
-        # Create a mask for the 'delivered' and 'generated' rows
-        delivered_mask = data['Tag'] == 'delivered'
-        generated_mask = data['Tag'] == 'generated'
-        
-        # Copy the 'kwHUsage' column to avoid changing the original data during calculations
-        data['net_kwHUsage'] = data['kwHUsage'].copy()
-        
-        # Iterate over each row and calculate the net usage for 'delivered' rows
-        for index, row in data[delivered_mask].iterrows():
-            # Find the corresponding 'generated' row based on Date, StartTime, and EndTime
-            corresponding_generated = data[
-                (data['Date'] == row['Date']) &
-                (data['StartTime'] == row['StartTime']) &
-                (data['EndTime'] == row['EndTime']) &
-                generated_mask
-            ]
-            
-            if not corresponding_generated.empty:
-                # Subtract the generated 'kwHUsage' from the delivered 'kwHUsage'
-                data.at[index, 'net_kwHUsage'] -= corresponding_generated.iloc[0]['kwHUsage']
-        
-        # Update the 'kwHUsage' column with the net values
-        data['kwHUsage'] = data['net_kwHUsage']
-        
-        # Drop the temporary 'net_kwHUsage' column
-        data.drop(columns=['net_kwHUsage'], inplace=True)
-        
-        # Save the updated DataFrame to the CSV file
+        data = format_frame(normalize_frame(read_output(outfile)))
         data.to_csv(outfile, index=False)
-        
         print(f"Net usage calculated...")
     except Exception as e:
         print(f"Error calculating net usage: {e}")
@@ -155,14 +578,10 @@ def normalize_kwh(outfile):
 # Add the delivery cost to the output file.
 # The delivery cost is based on the billing season, billing day, and TOU.
 # It is calculated as the product of the usage and the delivery cost.
-# the del_costs dictionary is based on SCE's TOU-D-Prime rate schedule.
-def add_delivery_cost(outfile):
+# The default tariff is based on SCE's TOU-D-Prime rate schedule.
+def add_delivery_cost(outfile, tariff=TOU_D_PRIME):
     try:
-        data = pd.read_csv(outfile, encoding='utf-8')
-
-        data['Cost'] = data.apply(
-            lambda row: row['kwHUsage'] * DELIVERY_COSTS.get((row['BillingSeason'], row['BillingDay'], row['TOU']), 0) 
-            if row['Tag'] == 'delivered' else 0, axis=1)
+        data = format_frame(delivery_cost_frame(read_output(outfile), tariff))
         data.to_csv(outfile, index=False)
         print("Delivery cost added...")
     except Exception as e:
@@ -171,94 +590,67 @@ def add_delivery_cost(outfile):
 # Add the received value to the output file.
 # The received value is based on the generated kwH. SCE's Pacific Time Zone ECC data found at: 
 # https://www.sce.com/sites/default/files/custom-files/PDF_Files/EEC_Factors_Nov_2023.xlsx
-def add_received_value(outfile):
-    # SCE offers an EEC bonus for customers that enroll in the first year of the Solar Billing Program.  Set to 0 if this if not applicable.
-    bonus = .04
+# SCE offers an EEC bonus for customers that enroll in the first year of the Solar Billing Program (see BONUS).
+def add_received_value(outfile, ecc_file=ECC_FILE):
     try:
-        source_df = pd.read_csv(outfile, encoding='utf-8')
-
-        # Modify the the path to the ECC data file
-        reference_df = pd.read_csv('/path/to/ECC_data.csv')
-    
-        # Manage the time format to support the reference data
-        source_df['StartTime'] = pd.to_datetime(source_df['StartTime'], format='%H:%M:%S').dt.hour
-        source_df['Month'] = pd.to_datetime(source_df['Month'], format='%B').dt.month
-        source_df.loc[source_df['StartTime'] == 0, 'StartTime'] = 24
-
-        generated_df = source_df[source_df['Tag'] == 'generated']
-
-        calculated_costs = []
-        for _, row in generated_df.iterrows():
-            year, month, hour = row['Year'], row['Month'], row['StartTime']
-            weekend = row['BillingDay'] == 'Weekend'
-            ref_row = reference_df[
-                (reference_df['Price Effective Date'] == year) & 
-                (reference_df['Month'] == month) & 
-                (reference_df['Hour'] == hour)
-            ]
-            if not ref_row.empty:
-                gen_cost = ref_row['SCE Gen - Weekend/Holiday EEC'].values[0] if weekend else ref_row['SCE Gen - Weekday EEC'].values[0]
-                del_cost = ref_row['Delivery - Weekend/Holiday EEC'].values[0] if weekend else ref_row['Delivery - Weekday EEC'].values[0]
-                cost = gen_cost + del_cost
-                bonus_value = row['kwHUsage'] * bonus
-                cost = cost + bonus_value
-                calculated_costs.append(row['kwHUsage'] * cost)
-            else:
-                calculated_costs.append(None)
-
-        generated_df.loc[:, 'Cost'] = calculated_costs
-        source_df.update(generated_df['Cost'])
-
-        # Reset the time format to the original
-        source_df['StartTime'] = source_df['StartTime'].apply(lambda x: '00:00:00' if x == 24 else datetime.time(x).strftime('%H:%M:%S'))
-        source_df['Month'] = pd.to_datetime(source_df['Month'], format='%m').dt.strftime('%B')
-        source_df.to_csv(outfile, index=False)
-
+        data = format_frame(received_value_frame(read_output(outfile), ecc_file))
+        data.to_csv(outfile, index=False)
         print(f"Generated value added...")
     except Exception as e:
         print(f"Error adding received value: {e}")
 
-# Consolidate the SBP's 15 minute blocks of time into single hour blocks.
-# This reduces the rows in the output file and make it easier to analyze in Excel as a Pivot Table.
 # Consolidate the SBP's 15 minute blocks of time into single hour blocks.
 # This reduces the rows in the output file and make it easier to analyze in Excel as a Pivot Table.
 def combine_data(outfile):
     try:
-        data = pd.read_csv(outfile, encoding='utf-8')
-        data['Hour'] = pd.to_datetime(data['StartTime'], format='%H:%M:%S').dt.hour
-        agg_dict = {
-                'kwHUsage': 'sum',
-                'Cost': 'sum',
-                'Season': 'first',
-                'Year': 'first',
-                'Month': 'first',
-                'BillingSeason': 'first',
-                'BillingDay': 'first',
-                'TOU': 'first'
-            }
-        grouped_data = data.groupby(['Date', 'Hour', 'Tag']).agg(agg_dict).reset_index()
-        grouped_data['StartTime'] = grouped_data['Hour'].apply(lambda x: f'{x:02}:00:00')
-        grouped_data['EndTime'] = grouped_data['Hour'].apply(lambda x: f'{x+1:02}:00:00' if x < 23 else '00:00:00')
-        grouped_data.drop(columns=['Hour'], inplace=True)
-        ordered_columns = ['Date', 'StartTime', 'EndTime', 'kwHUsage', 'Tag', 'Season', 'Year', 'Month', 'BillingSeason', 'BillingDay', 'TOU', 'Cost']
-        grouped_data = grouped_data[ordered_columns]
-        
-        grouped_data.to_csv(outfile, index=False)
+        data = format_frame(combine_frame(read_output(outfile)))
+        data.to_csv(outfile, index=False)
         print("Data combined...")
     except Exception as e:
         print(f"Error combining data: {e}")
 
 # Main function to run the program
 if __name__ == "__main__":
-    input_file = "/path/to/sce_usage.csv"
-    output_file = input_file.split('.')[0] + "_parsed.csv"
+    parser = argparse.ArgumentParser(description="Parse an SCE usage file and calculate the cost/value of each hour.")
+    parser.add_argument("input_file", nargs="?", default="/path/to/sce_usage.csv", help="SCE_Usage.csv file downloaded from SCE")
+    parser.add_argument("--output", help="output file (default: <input_file>_parsed.csv)")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    parser.add_argument("--tariff", help="tariff JSON file (default: TOU-D-PRIME)")
+    parser.add_argument("--stream", action="store_true", help="process the file a chunk of periods at a time")
+    parser.add_argument("--report", help="write a JSON run report with the time, memory and rows of each stage")
+    parser.add_argument("--profile", help="run under cProfile and save the stats to this file")
+    parser.add_argument("--parquet", help="also write the rows to this Parquet dataset folder")
+    parser.add_argument("--feather", help="also write the rows to this Feather dataset folder")
+    parser.add_argument("--sqlite", help="also write the rows to this SQLite file")
+    parser.add_argument("--account", help="account for the extra outputs (default: taken from the file name)")
+    args = parser.parse_args()
+    input_file = args.input_file
+    output_file = args.output or input_file.split('.')[0] + "_parsed.csv"
+
+    writers = {}
+    if args.parquet or args.feather or args.sqlite:
+        import functools
+        from SCE_dataset import write_dataset, write_sqlite
+        from SCE_store import account_from_filename
+        account = args.account or account_from_filename(input_file)
+        if args.parquet:
+            writers["parquet"] = functools.partial(write_dataset, folder=args.parquet, account=account, file_format="parquet")
+        if args.feather:
+            writers["feather"] = functools.partial(write_dataset, folder=args.feather, account=account, file_format="feather")
+        if args.sqlite:
+            writers["sqlite"] = functools.partial(write_sqlite, path=args.sqlite, account=account)
 
-    write_header(output_file)
-    parse_data(input_file, output_file)
-    enrich_data(output_file)
-    normalize_kwh(output_file)
-    add_delivery_cost(output_file)
-    add_received_value(output_file)
-    combine_data(output_file)
+    tariff = load_tariff(args.tariff) if args.tariff else TOU_D_PRIME
+    report = RunReport(input=input_file, output=output_file)
+    with profile(args.profile) if args.profile else contextlib.nullcontext():
+        if args.stream:
+            process_usage_stream(input_file, output_file, args.ecc, tariff, report=report, writers=writers)
+        else:
+            process_usage(input_file, output_file, args.ecc, tariff, report=report, writers=writers)
+    if args.report:
+        report.save(args.report)
+        print("Run report stored in " + args.report)
 
+    if report.status != "ok":
+        sys.exit(1)
     print("Parsing complete and stored in " + output_file)
@@ -0,0 +1,143 @@
+# Description: Pre-aggregates valued intervals into hourly, daily, monthly, billing-season and TOU-period tables.
+# The intervals are sorted once by (tag, hour, TOU period) and totalled into cells.  Every table is then summed from
+# the cells between the positions where its keys change, so no table needs its own groupby over the intervals.  The tables are small enough to save to SQLite and query instead of pivoting the interval table.
+
+import argparse
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from SCE_ecc import load_ecc_table
+from SCE_parse import (ECC_FILE, TOU_D_PRIME, delivery_cost_frame, enrich_frame, load_tariff, normalize_frame,
+                       parse_frame, received_value_frame, usage_kwh)
+
+# Keys of each table, in sort order.  Start is the start of the hour, day or month.
+LEVELS = {
+    "hourly": ["Tag", "Start"],
+    "daily": ["Tag", "Start"],
+    "monthly": ["Tag", "Start"],
+    "billing_season": ["Tag", "Year", "BillingSeason"],
+    "tou": ["Tag", "Start", "BillingDay", "TOU"],
+}
+LABELS = ["Tag", "Year", "BillingSeason", "BillingDay", "TOU"]
+VALUES = ["kwHUsage", "Cost", "Intervals"]
+
+# Return the first row of every run of equal keys and the totals of each run.  keys are integer arrays in sorted
+# order and values the per-row amounts.  Each run is summed on its own with reduceat, so a total only carries the
+# rounding of its own rows, not of every row before it as a difference of cumulative sums would.
+def run_totals(keys, values):
+    size = len(values)
+    change = np.zeros(size, dtype=bool)
+    change[:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    firsts = np.flatnonzero(change)
+    return firsts, np.add.reduceat(values, firsts, axis=0)
+
+def table(cells, firsts, totals, columns):
+    output = cells.iloc[firsts][columns].reset_index(drop=True)
+    for i, column in enumerate(VALUES):
+        output[column] = totals[:, i]
+    output['Intervals'] = output['Intervals'].astype(np.int64)
+    return output
+
+class Rollup:
+    def __init__(self, tables):
+        # Level name -> DataFrame of its keys, label columns and totals
+        self.tables = tables
+
+    # Aggregate valued intervals (the output of received_value_frame()).  Cost is the delivery cost of the
+    # delivered rows and the received value of the generated rows.
+    @classmethod
+    def from_intervals(cls, data):
+        starts = data['Start'].to_numpy(dtype='datetime64[s]')
+        hours = starts.astype('datetime64[h]')
+        tags = data['Tag'].cat.codes.to_numpy()
+        tou = data['TOU'].cat.codes.to_numpy()
+        order = np.lexsort((tou, hours, tags))
+        values = np.column_stack([usage_kwh(data), data['Cost'].to_numpy(dtype=float), np.ones(len(data))])[order]
+
+        # Cells: one row per tag, hour and TOU period, the finest grain every table is cut from
+        firsts, totals = run_totals([tags[order], hours[order].astype(np.int64), tou[order]], values)
+        cells = data.iloc[order[firsts]][LABELS].reset_index(drop=True)
+        cells.insert(1, 'Start', hours[order][firsts].astype('datetime64[s]'))
+        cell_values = totals
+
+        tables = {}
+        cell_tags = cells['Tag'].cat.codes.to_numpy()
+        for level, unit in (("hourly", 'h'), ("daily", 'D'), ("monthly", 'M')):
+            periods = cells['Start'].to_numpy().astype(f'datetime64[{unit}]')
+            firsts, totals = run_totals([cell_tags, periods.astype(np.int64)], cell_values)
+            tables[level] = table(cells.assign(Start=periods.astype('datetime64[s]')), firsts, totals,
+                                  ["Tag", "Start"] + (["Year"] if level == "monthly" else []))
+
+        # The billing-season and TOU tables regroup the cells, which only takes a sort of the much smaller cell table
+        months = cells['Start'].to_numpy().astype('datetime64[M]')
+        for level, keys in (("billing_season", [cell_tags, cells['Year'].to_numpy(), cells['BillingSeason'].cat.codes.to_numpy()]),
+                            ("tou", [cell_tags, months.astype(np.int64), cells['BillingDay'].cat.codes.to_numpy(), cells['TOU'].cat.codes.to_numpy()])):
+            order = np.lexsort(keys[::-1])
+            firsts, totals = run_totals([key[order] for key in keys], cell_values[order])
+            sorted_cells = cells.iloc[order].reset_index(drop=True).assign(Start=months[order].astype('datetime64[s]'))
+            columns = ["Tag", "Year", "BillingSeason"] if level == "billing_season" else ["Tag", "Start", "BillingSeason", "BillingDay", "TOU"]
+            tables[level] = table(sorted_cells, firsts, totals, columns)
+        return cls(tables)
+
+    # Return the rows of one table.  start and end limit the Start column (end is exclusive); any other keyword
+    # selects rows by column value, e.g. query("tou", Tag="delivered", TOU="On-Peak", BillingDay="Weekday").
+    def query(self, level, start=None, end=None, **filters):
+        data = self.tables[level]
+        mask = np.ones(len(data), dtype=bool)
+        if start is not None:
+            mask &= (data['Start'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (data['Start'] < pd.Timestamp(end)).to_numpy()
+        for column, value in filters.items():
+            mask &= (data[column] == value).to_numpy()
+        return data[mask].reset_index(drop=True)
+
+    # Save every table to a SQLite file, indexed on its keys
+    def save(self, path):
+        con = sqlite3.connect(path)
+        try:
+            with con:
+                for level, data in self.tables.items():
+                    data.to_sql(level, con, if_exists='replace', index=False)
+                    con.execute(f"CREATE INDEX IF NOT EXISTS {level}_keys ON {level} ({', '.join(LEVELS[level])})")
+        finally:
+            con.close()
+
+    @classmethod
+    def load(cls, path):
+        con = sqlite3.connect(path)
+        try:
+            tables = {}
+            for level in LEVELS:
+                data = pd.read_sql_query(f"SELECT * FROM {level}", con)
+                if 'Start' in data.columns:
+                    data['Start'] = pd.to_datetime(data['Start'])
+                tables[level] = data
+            return cls(tables)
+        finally:
+            con.close()
+
+# Parse, enrich, net and value a usage file and roll it up
+def rollup_usage(infile, ecc_file=ECC_FILE, tariff=TOU_D_PRIME):
+    data = enrich_frame(parse_frame(infile), tariff)
+    data = received_value_frame(delivery_cost_frame(normalize_frame(data), tariff), ecc_file)
+    return Rollup.from_intervals(data)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-aggregate an SCE usage file into rollup tables.")
+    parser.add_argument("input_file", help="SCE_Usage.csv file downloaded from SCE")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    parser.add_argument("--tariff", help="tariff JSON file (default: TOU-D-PRIME)")
+    parser.add_argument("--output", help="save the tables to this SQLite file")
+    parser.add_argument("--level", choices=list(LEVELS), default="monthly", help="table to print")
+    args = parser.parse_args()
+
+    tariff = load_tariff(args.tariff) if args.tariff else TOU_D_PRIME
+    rollup = rollup_usage(args.input_file, load_ecc_table(args.ecc), tariff)
+    if args.output:
+        rollup.save(args.output)
+        print("Rollup stored in " + args.output)
+    print(rollup.query(args.level).to_string(index=False))
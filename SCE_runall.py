@@ -1,17 +1,87 @@
-import time
-
-# List of scripts to run sequentially
-scripts = ['sceDownloadData.py', 'sceOptimv4.py', 'sceCopyData.py']
-
-for script in scripts:
-    with open(script) as f:
-        code = f.read()
-        try:
-            exec(code)
-        except Exception as e:
-            print(f'Error running {script}: {e}')
-            break
-    if script != scripts[-1]:
-        time.sleep(5)  # Pause for 5 seconds
-
-print("All scripts have been run.")
+import argparse
+import sys
+import pandas as pd
+
+from SCE_instrument import RunReport, stage
+from SCE_parse import ECC_FILE, TOU_D_PRIME, load_tariff, process_usage
+import SCE_merge_data
+
+# Stages in the order they run
+STAGES = ['download', 'parse', 'merge']
+# SCE_download.py moves the downloaded file here
+DOWNLOAD_FILE = "SCE_Usage.csv"
+
+# Download a new usage file.  SCE_download.py (and Selenium) is only imported when this stage is selected.
+def run_download():
+    import SCE_download
+    with stage("download") as record:
+        path = SCE_download.main()
+        record["rows_out"] = 1 if path else 0
+    return path
+
+def run_merge(data, xlsx_path, store=None):
+    with stage("merge", len(data) if data is not None else None) as record:
+        last_row = SCE_merge_data.merge_data(data, xlsx_path, store)
+        record["rows_out"] = last_row
+    return last_row
+
+# Run the selected stages in-process.  The hourly DataFrame from the parse stage is handed straight to the merge
+# stage instead of being read back from the _parsed.csv file.  Returns False if a stage failed.
+def run_all(stages=STAGES, input_file=DOWNLOAD_FILE, output_file=None, ecc_file=ECC_FILE, tariff=TOU_D_PRIME,
+            xlsx_path=None, report=None):
+    report = report or RunReport(stages=list(stages))
+    output_file = output_file or input_file.split('.')[0] + "_parsed.csv"
+    data = None
+    with report:
+        if 'download' in stages:
+            input_file = run_download()
+            if input_file is None:
+                return stop(report, 'download')
+            output_file = input_file.split('.')[0] + "_parsed.csv"
+
+        if 'parse' in stages:
+            data = process_usage(input_file, output_file, ecc_file, tariff, report)
+            if data is None:
+                return stop(report, 'parse')
+
+        if 'merge' in stages:
+            # Without the parse stage, merge the _parsed.csv file it wrote on an earlier run (or, when store_path is
+            # set in SCE_merge_data.py, the store's unexported rows)
+            if data is None and not SCE_merge_data.store_path:
+                try:
+                    data = pd.read_csv(output_file)
+                except Exception as e:
+                    print(f"Error reading {output_file}: {e}")
+                    return stop(report, 'merge')
+            if run_merge(data, xlsx_path) is None:
+                return stop(report, 'merge')
+    return True
+
+def stop(report, name):
+    print(f"Error running {name}, stopping.")
+    if report.status is None:
+        report.fail(f"{name} failed")
+    return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download, parse and merge SCE usage data in one process.")
+    parser.add_argument("stages", nargs="*", choices=STAGES, default=STAGES, help="stages to run (default: all)")
+    parser.add_argument("--input", default=DOWNLOAD_FILE, help="usage file to parse when the download stage is skipped")
+    parser.add_argument("--output", help="parsed output file (default: <input>_parsed.csv)")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    parser.add_argument("--tariff", help="tariff JSON file (default: TOU-D-PRIME)")
+    parser.add_argument("--xlsx", help="master workbook (default: xlsx_file_path in SCE_merge_data.py)")
+    parser.add_argument("--report", help="write a JSON run report with the time, memory and rows of each stage")
+    args = parser.parse_args()
+
+    stages = [name for name in STAGES if name in args.stages]
+    tariff = load_tariff(args.tariff) if args.tariff else TOU_D_PRIME
+    report = RunReport(stages=stages)
+    succeeded = run_all(stages, args.input, args.output, args.ecc, tariff, args.xlsx, report)
+    if succeeded:
+        print("All stages have been run.")
+    if args.report:
+        report.save(args.report)
+        print("Run report stored in " + args.report)
+    if not succeeded:
+        sys.exit(1)
@@ -0,0 +1,155 @@
+# Description: A local stand-in for SCE's login page and EscGreenButtonData download, serving SCE_synthetic.py
+# usage files, so SCE_download.py can be run and tested without an SCE account.  The pages keep the element ids and
+# layout the Selenium steps look for, the download needs the session cookie set by the login, and Range requests
+# are answered so interrupted downloads can be resumed.  --drop-after cuts the first response of every file short
+# to exercise the resume.
+
+import argparse
+import datetime
+import os
+import secrets
+import tempfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from SCE_download import DATA_PATH, DATE_FORMAT, DOWNLOAD_PATH, LOGIN_PATH
+from SCE_synthetic import write_usage_file
+
+USERNAME = "user"
+PASSWORD = "pass"
+SESSION_COOKIE = "SCESESSION"
+
+# The real page has a second, hidden copy of the login fields, and SCE_download.py fills in the second one
+LOGIN_PAGE = """<html><body><div id="react-login-main"><div><div><section><div></div><div></div><div>
+<form method="post" action="{login}"><div></div><div><div><input id="userName" name="unused_user"/></div>
+<div><input id="password" name="unused_password" type="password"/></div><div></div><div></div></div></form>
+<form method="post" action="{login}"><div></div><div><div><input id="userName" name="username"/></div>
+<div><input id="password" name="password" type="password"/></div><div></div><div><button type="submit">Log In</button></div>
+</div></form></div></section></div></div></div></body></html>"""
+
+DATA_PAGE = """<html><body><div id="datadownload-content"><div><div><div><section><div><div></div><div><div></div>
+<div></div><div></div><div><div></div><div><div><div><div></div><div>Download</div></div></div></div></div></div>
+</div></section></div></div></div></div></body></html>"""
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def logged_in(self):
+        cookies = dict(part.strip().split("=", 1) for part in self.headers.get("Cookie", "").split(";") if "=" in part)
+        return cookies.get(SESSION_COOKIE) in self.server.sessions
+
+    def send_page(self, page, status=200):
+        body = page.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header("Location", location)
+        if cookie:
+            self.send_header("Set-Cookie", f"{SESSION_COOKIE}={cookie}; Path=/; HttpOnly")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == LOGIN_PATH:
+            self.send_page(LOGIN_PAGE.format(login=LOGIN_PATH))
+        elif not self.logged_in():
+            self.redirect(LOGIN_PATH)
+        elif url.path == DATA_PATH:
+            self.send_page(DATA_PAGE)
+        elif url.path == DOWNLOAD_PATH:
+            self.send_usage(urllib.parse.parse_qs(url.query))
+        else:
+            self.send_page("<html><body>Not found</body></html>", 404)
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        if self.path != LOGIN_PATH:
+            self.send_page("<html><body>Not found</body></html>", 404)
+        elif form.get("username") == [USERNAME] and form.get("password") == [PASSWORD]:
+            session = secrets.token_hex(16)
+            self.server.sessions.add(session)
+            self.redirect(DATA_PATH, session)
+        else:
+            self.redirect(LOGIN_PATH)
+
+    def send_usage(self, query):
+        try:
+            start = datetime.datetime.strptime(query["fromDate"][0], DATE_FORMAT).date()
+            end = datetime.datetime.strptime(query["toDate"][0], DATE_FORMAT).date()
+        except (KeyError, ValueError):
+            self.send_page("<html><body>Bad date range</body></html>", 400)
+            return
+        body = self.server.usage_file(start, end)
+        first = 0
+        if self.headers.get("Range", "").startswith("bytes="):
+            first = int(self.headers["Range"][len("bytes="):].split("-")[0])
+        self.send_response(206 if first else 200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Disposition", f'attachment; filename="SCE_Usage_{start:%m-%d-%y}_to_{end:%m-%d-%y}.csv"')
+        self.send_header("Content-Length", str(len(body) - first))
+        if first:
+            self.send_header("Content-Range", f"bytes {first}-{len(body) - 1}/{len(body)}")
+        self.end_headers()
+
+        key = (start, end)
+        with self.server.lock:
+            drop = self.server.drop_after and key not in self.server.dropped
+            self.server.dropped.add(key)
+            self.server.downloads += 1
+        if drop:
+            # Send part of the file and close the connection, like a dropped download
+            self.wfile.write(body[first:first + self.server.drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body[first:])
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8000), drop_after=0, verbose=False):
+        super().__init__(address, StandInHandler)
+        self.sessions = set()
+        self.drop_after = drop_after
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.dropped = set()
+        self.downloads = 0
+        self.folder = tempfile.mkdtemp(prefix="sce_standin_")
+        self.files = {}
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    # The synthetic usage file of a date range, written once and then served from memory
+    def usage_file(self, start, end):
+        with self.lock:
+            if (start, end) not in self.files:
+                path = os.path.join(self.folder, f"{start:%Y%m%d}_{end:%Y%m%d}.csv")
+                write_usage_file(path, (end - start).days + 1, start, seed=start.toordinal())
+                with open(path, "rb") as f_in:
+                    self.files[(start, end)] = f_in.read()
+                os.remove(path)
+            return self.files[(start, end)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for SCE's login and Green Button download pages.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--drop-after", type=int, default=0, help="cut the first response of every file after this many bytes")
+    args = parser.parse_args()
+
+    server = StandInServer(("127.0.0.1", args.port), args.drop_after, verbose=True)
+    print(f"Serving the SCE stand-in on {server.base_url} (log in as {USERNAME} / {PASSWORD})...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped.")
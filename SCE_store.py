@@ -0,0 +1,177 @@
+# Description: Keeps a persistent SQLite store of parsed intervals so each download only costs its new work.
+# Raw intervals are keyed on (account, interval start, tag) and the hourly output on (account, hour, tag).
+# A watermark records the last interval stored for each account.  Intervals past the watermark and revised
+# intervals are the only ones valued again, and overlapping downloads replace rows instead of adding them.
+# Each hourly row records the workbook row it was exported to; revaluing an hour clears it, so the new values are
+# exported again and overwrite the workbook rows that hold the old ones.
+
+import argparse
+import os
+import re
+import sqlite3
+import pandas as pd
+
+from SCE_ecc import load_ecc_table
+from SCE_parse import ECC_FILE, HEADER, TOU_D_PRIME, combine_repeated, format_frame, process_frame, read_usage, usage_frame, usage_kwh
+
+# Modify the the path to the interval store
+STORE_FILE = '/path/to/sce_usage.db'
+# The account is taken from SCE's download name, e.g. SCE_Usage_1234567890_05-01-24_to_05-31-24.csv
+ACCOUNT_PATTERN = re.compile(r'SCE_Usage_(.+?)_\d{2}-\d{2}-\d{2}_to_')
+DEFAULT_ACCOUNT = 'default'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intervals (
+    account TEXT NOT NULL, start TEXT NOT NULL, tag TEXT NOT NULL, end TEXT NOT NULL, hour TEXT NOT NULL,
+    kwh REAL NOT NULL, PRIMARY KEY (account, start, tag));
+CREATE INDEX IF NOT EXISTS intervals_hour ON intervals (account, hour);
+CREATE TABLE IF NOT EXISTS hourly (
+    account TEXT NOT NULL, hour TEXT NOT NULL, Date TEXT, StartTime TEXT, EndTime TEXT, kwHUsage REAL,
+    Tag TEXT NOT NULL, Season TEXT, Year INTEGER, Month TEXT, BillingSeason TEXT, BillingDay TEXT, TOU TEXT,
+    Cost REAL, xlsx_row INTEGER, PRIMARY KEY (account, hour, Tag));
+CREATE INDEX IF NOT EXISTS hourly_pending ON hourly (account, hour) WHERE xlsx_row IS NULL;
+CREATE TABLE IF NOT EXISTS watermarks (account TEXT PRIMARY KEY, last_start TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS stale_rows (
+    xlsx_row INTEGER PRIMARY KEY, account TEXT NOT NULL, hour TEXT NOT NULL, Tag TEXT NOT NULL);
+"""
+
+def connect(store=STORE_FILE):
+    con = sqlite3.connect(store)
+    con.executescript(SCHEMA)
+    return con
+
+def account_from_filename(infile):
+    match = ACCOUNT_PATTERN.search(os.path.basename(infile))
+    return match.group(1) if match else DEFAULT_ACCOUNT
+
+def watermark(con, account):
+    row = con.execute("SELECT last_start FROM watermarks WHERE account = ?", (account,)).fetchone()
+    return row[0] if row else None
+
+# Store the intervals of a usage file and revalue only the hours they change.
+# Returns the number of intervals that were new or revised.
+def update_store(infile, store=STORE_FILE, account=None, ecc_file=ECC_FILE, tariff=TOU_D_PRIME):
+    account = account or account_from_filename(infile)
+    usage = combine_repeated(read_usage(infile))
+    if usage.empty:
+        return 0
+    usage = pd.DataFrame({
+        'start': usage['Start'].dt.strftime(TIME_FORMAT),
+        'tag': usage['Tag'].astype(object),
+        'end': (usage['Start'] + pd.to_timedelta(usage['Minutes'].astype('int64'), unit='m')).dt.strftime(TIME_FORMAT),
+        'hour': usage['Start'].dt.floor('h').dt.strftime(TIME_FORMAT),
+        'kwh': usage_kwh(usage),
+    })
+
+    con = connect(store)
+    try:
+        with con:
+            last_start = watermark(con, account)
+            first, last = usage['start'].min(), usage['start'].max()
+
+            # Only the part of the download at or before the watermark can hold revisions
+            changed = usage[usage['start'] > last_start] if last_start else usage
+            removed = pd.DataFrame(columns=['start', 'tag', 'hour'])
+            if last_start and first <= last_start:
+                stored = pd.read_sql_query(
+                    "SELECT start, tag, hour, kwh FROM intervals WHERE account = ? AND start BETWEEN ? AND ?",
+                    con, params=(account, first, min(last, last_start)))
+                overlap = usage[usage['start'] <= last_start].merge(
+                    stored, on=['start', 'tag', 'hour'], how='outer', suffixes=('', '_stored'), indicator=True)
+                revised = overlap[(overlap['_merge'] == 'left_only') | ((overlap['_merge'] == 'both') & (overlap['kwh'] != overlap['kwh_stored']))]
+                # Intervals missing from the new download now read zero, which the reader drops
+                removed = overlap.loc[overlap['_merge'] == 'right_only', ['start', 'tag', 'hour']]
+                changed = pd.concat([changed, revised[usage.columns]], ignore_index=True)
+            if changed.empty and removed.empty:
+                print(f"No new intervals for account {account}...")
+                return 0
+
+            con.executemany("DELETE FROM intervals WHERE account = ? AND start = ? AND tag = ?",
+                            [(account, start, tag) for start, tag in zip(removed['start'], removed['tag'])])
+            con.executemany("INSERT OR REPLACE INTO intervals VALUES (?, ?, ?, ?, ?, ?)",
+                            [(account, *row) for row in changed[['start', 'tag', 'end', 'hour', 'kwh']].itertuples(index=False)])
+
+            # Revalue every touched hour from the stored intervals of both tags, since netting pairs them
+            hours = sorted(set(changed['hour']) | set(removed['hour']))
+            con.execute("CREATE TEMP TABLE IF NOT EXISTS touched (hour TEXT PRIMARY KEY)")
+            con.execute("DELETE FROM touched")
+            con.executemany("INSERT INTO touched VALUES (?)", [(hour,) for hour in hours])
+            intervals = pd.read_sql_query(
+                "SELECT start, end, kwh, tag FROM intervals WHERE account = ? AND hour IN (SELECT hour FROM touched) ORDER BY start",
+                con, params=(account,))
+            # The workbook rows holding the old values of exported hours are overwritten on the next export
+            con.execute("INSERT OR REPLACE INTO stale_rows SELECT xlsx_row, account, hour, Tag FROM hourly "
+                        "WHERE account = ? AND hour IN (SELECT hour FROM touched) AND xlsx_row IS NOT NULL", (account,))
+            con.execute("DELETE FROM hourly WHERE account = ? AND hour IN (SELECT hour FROM touched)", (account,))
+            if not intervals.empty:
+                hourly = format_frame(process_frame(usage_frame(
+                    pd.to_datetime(intervals['start'], format=TIME_FORMAT), pd.to_datetime(intervals['end'], format=TIME_FORMAT),
+                    intervals['kwh'], intervals['tag']), ecc_file, tariff))
+                hourly.insert(0, 'hour', hourly['Date'] + ' ' + hourly['StartTime'])
+                hourly.insert(0, 'account', account)
+                con.executemany(f"INSERT INTO hourly ({', '.join(hourly.columns)}) VALUES ({', '.join('?' * len(hourly.columns))})",
+                                hourly.astype(object).itertuples(index=False))
+
+            con.execute("INSERT INTO watermarks (account, last_start) VALUES (?, ?) "
+                        "ON CONFLICT (account) DO UPDATE SET last_start = max(last_start, excluded.last_start)",
+                        (account, last))
+        print(f"{len(changed) + len(removed)} intervals stored for account {account}...")
+        return len(changed) + len(removed)
+    finally:
+        con.close()
+
+# Return the stored hourly rows in the _parsed.csv layout
+def load_hourly(store=STORE_FILE, account=None, since=None):
+    query, params = "SELECT * FROM hourly WHERE 1 = 1", []
+    if account:
+        query += " AND account = ?"
+        params.append(account)
+    if since:
+        query += " AND hour >= ?"
+        params.append(since)
+    con = connect(store)
+    try:
+        return pd.read_sql_query(query + " ORDER BY account, hour, Tag", con, params=params)[['account'] + HEADER]
+    finally:
+        con.close()
+
+# Return the hourly rows that have not been exported yet, in the _parsed.csv layout with the account, hour and
+# xlsx_row.  xlsx_row is the workbook row holding an earlier value of the row, or NaN for a row to append.  A stale
+# workbook row whose hour and tag no longer have a value comes back with empty values, so it is blanked.
+def pending_hourly(store=STORE_FILE):
+    con = connect(store)
+    try:
+        columns = ', '.join(f'h.{column} AS {column}' for column in ['account', 'hour'] + HEADER)
+        return pd.read_sql_query(
+            f"SELECT {columns}, s.xlsx_row FROM hourly h LEFT JOIN stale_rows s "
+            "ON s.account = h.account AND s.hour = h.hour AND s.Tag = h.Tag WHERE h.xlsx_row IS NULL "
+            "UNION ALL SELECT s.account, s.hour, " + ', '.join(['NULL'] * len(HEADER)) + ", s.xlsx_row FROM stale_rows s "
+            "WHERE NOT EXISTS (SELECT 1 FROM hourly h WHERE h.account = s.account AND h.hour = s.hour AND h.Tag = s.Tag "
+            "AND h.xlsx_row IS NULL) ORDER BY account, hour, Tag", con)
+    finally:
+        con.close()
+
+# Record the workbook row each of the rows returned by pending_hourly() was written to
+def mark_exported(rows, store=STORE_FILE):
+    con = connect(store)
+    try:
+        with con:
+            con.executemany("UPDATE hourly SET xlsx_row = ? WHERE account = ? AND hour = ? AND Tag = ? AND xlsx_row IS NULL",
+                            [(int(row), account, hour, tag) for account, hour, tag, row
+                             in zip(rows['account'], rows['hour'], rows['Tag'], rows['xlsx_row']) if pd.notna(tag)])
+            con.executemany("DELETE FROM stale_rows WHERE xlsx_row = ?", [(int(row),) for row in rows['xlsx_row']])
+    finally:
+        con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add SCE usage files to the interval store.")
+    parser.add_argument("input_files", nargs="+", help="SCE_Usage.csv files downloaded from SCE")
+    parser.add_argument("--store", default=STORE_FILE, help="SQLite interval store")
+    parser.add_argument("--account", help="service account (default: taken from the file name)")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    args = parser.parse_args()
+
+    ecc = load_ecc_table(args.ecc)
+    for input_file in args.input_files:
+        update_store(input_file, args.store, args.account, ecc)
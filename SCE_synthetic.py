@@ -0,0 +1,148 @@
+# Description: Writes synthetic SCE Green Button usage files for testing and benchmarking.
+# The files follow the layout of SCE's downloads: the header block, one "Data for period starting" section per
+# day for delivered and received energy, and the non-breaking space after each start time.
+
+import argparse
+import datetime
+import os
+import numpy as np
+import pandas as pd
+
+NBSP = '\xa0'
+# Some downloads carry the UTF-8 non-breaking space decoded as Latin-1
+MOJIBAKE = 'Â\xa0'
+ESPI_TIMEZONE = 'America/Los_Angeles'
+
+HEADER_BLOCK = [
+    "﻿Energy Usage Information,,",
+    "For location: Someplace served by SCE,,",
+    ",,",
+    "Meter Reading Information,,",
+    "Type of readings: Electricity,,",
+    ",,",
+    "Summary of Electric Power Usage Information*,,",
+    "\"Your download will contain interval usage data that is currently available for your selected Service Account. "
+    "Based on how our systems process and categorize usage data, your download may contain usage data of the following "
+    "types: actual, estimated, validated or missing. \",,",
+    ",,",
+    "Detailed Usage,,",
+]
+SECTIONS = [("Delivered", 0), ("Received", 1)]
+
+# Return the delivered and received kwH of every interval of a household with rooftop solar
+def synthetic_usage(starts, interval_minutes, rng):
+    hours = starts.hour + starts.minute / 60
+    scale = interval_minutes / 60
+    # Base load with a morning and an evening peak, and more air conditioning in summer
+    load = 0.4 + 0.5 * np.exp(-((hours - 7.5) ** 2) / 2) + 1.2 * np.exp(-((hours - 19) ** 2) / 4)
+    load = load * (1 + 0.6 * np.isin(starts.month, [6, 7, 8, 9])) * rng.lognormal(0, 0.25, len(starts))
+    # Solar output follows the sun, dimmed by passing clouds
+    daylight = 12 + 2 * np.sin(2 * np.pi * (starts.dayofyear - 80) / 365)
+    sun = np.clip(np.cos(np.pi * (hours - 12.5) / daylight), 0, None)
+    clouds = rng.uniform(0.4, 1.0, len(starts))
+    solar = 5.0 * sun * clouds
+    delivered = np.round(np.clip(load - solar, 0, None) * scale, 2)
+    received = np.round(np.clip(solar - load, 0, None) * scale, 2)
+    return delivered, received
+
+# Return the interval boundaries and the delivered and received kwH of the given number of days
+def synthetic_series(days, start, interval_minutes, seed):
+    rng = np.random.default_rng(seed)
+    per_day = 24 * 60 // interval_minutes
+    stamps = pd.date_range(pd.Timestamp(start), periods=days * per_day + 1, freq=pd.Timedelta(minutes=interval_minutes))
+    delivered, received = synthetic_usage(stamps[:-1], interval_minutes, rng)
+    return stamps, delivered, received
+
+# Write one synthetic usage file covering the given number of days
+def write_usage_file(path, days, start=datetime.date(2024, 1, 1), interval_minutes=15, seed=0, mojibake=False):
+    space = MOJIBAKE if mojibake else NBSP
+    per_day = 24 * 60 // interval_minutes
+    first = pd.Timestamp(start)
+    stamps, delivered, received = synthetic_series(days, start, interval_minutes, seed)
+    texts = np.asarray(stamps.strftime('%Y-%m-%d %H:%M:%S'), dtype=object)
+
+    with open(path, 'w', encoding='utf-8', newline='') as f_out:
+        lines = HEADER_BLOCK + [f"Start date: {(first - pd.Timedelta(hours=1)):%Y-%m-%d %H:%M:%S}{space} for {days} day{'s' if days != 1 else ''},,", ",,"]
+        f_out.write('\r\n'.join(lines) + '\r\n')
+        for day in range(days):
+            rows = slice(day * per_day, (day + 1) * per_day)
+            period = f"Data for period starting: {texts[day * per_day]}{space} for 24 hours,,"
+            for name, column in SECTIONS:
+                values = (delivered, received)[column][rows]
+                lines = [period, f"Energy {space}{name} time period,Usage{space}{name}(Real energy in kilowatt-hours)(Real energy in kilowatt-hours),Reading quality"]
+                lines += [f"{begin}{space}to {end},{value:g}," for begin, end, value in zip(texts[rows], texts[day * per_day + 1:(day + 1) * per_day + 1], values)]
+                lines.append(",,")
+                f_out.write('\r\n'.join(lines) + '\r\n')
+    return path
+
+# Write the same readings as write_usage_file() as a Green Button ESPI feed, with one IntervalBlock per day for each
+# flow direction.  With reading_types_last the ReadingType entries come after the blocks that refer to them.
+def write_espi_file(path, days, start=datetime.date(2024, 1, 1), interval_minutes=15, seed=0, reading_types_last=False):
+    per_day = 24 * 60 // interval_minutes
+    stamps, delivered, received = synthetic_series(days, start, interval_minutes, seed)
+    # Times are UTC epoch seconds counted from the Pacific start time, so unlike the CSV the readings follow the
+    # daylight saving changes of the local clock
+    step = interval_minutes * 60
+    first = pd.Timestamp(start).tz_localize(ESPI_TIMEZONE).tz_convert('UTC').tz_localize(None)
+    epochs = int(first.to_datetime64().astype('datetime64[s]').astype(np.int64)) + step * np.arange(len(stamps))
+    base = "https://example.com/DataCustodian/espi/1_1/resource"
+    usage_point = f"{base}/Subscription/1/UsagePoint/1"
+
+    def entry(self_link, content, related=(), up=None):
+        links = [f'<link rel="self" href="{self_link}"/>'] + [f'<link rel="related" href="{href}"/>' for href in related]
+        if up:
+            links.append(f'<link rel="up" href="{up}"/>')
+        return f'<entry><id>urn:uuid:{self_link.rsplit("/", 2)[-2]}-{self_link.rsplit("/", 1)[-1]}</id>{"".join(links)}<content>{content}</content></entry>\n'
+
+    with open(path, 'w', encoding='utf-8') as f_out:
+        f_out.write('<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom" xmlns:espi="http://naesb.org/espi">\n')
+        f_out.write(entry(usage_point, '<espi:UsagePoint><espi:ServiceCategory><espi:kind>0</espi:kind></espi:ServiceCategory></espi:UsagePoint>'))
+        types = []
+        for number, (flow, values) in enumerate(((1, delivered), (19, received)), start=1):
+            meter_reading = f"{usage_point}/MeterReading/{number}"
+            f_out.write(entry(meter_reading, '<espi:MeterReading/>', related=[f"{base}/ReadingType/{number}", f"{meter_reading}/IntervalBlock"]))
+            types.append(entry(f"{base}/ReadingType/{number}", f'<espi:ReadingType><espi:accumulationBehaviour>4</espi:accumulationBehaviour>'
+                               f'<espi:flowDirection>{flow}</espi:flowDirection><espi:intervalLength>{interval_minutes * 60}</espi:intervalLength>'
+                               '<espi:kind>12</espi:kind><espi:powerOfTenMultiplier>0</espi:powerOfTenMultiplier><espi:uom>72</espi:uom></espi:ReadingType>'))
+            if not reading_types_last:
+                f_out.write(types[-1])
+            for day in range(days):
+                rows = range(day * per_day, (day + 1) * per_day)
+                readings = ''.join(f'<espi:IntervalReading><espi:timePeriod><espi:duration>{step}</espi:duration>'
+                                   f'<espi:start>{epochs[i]}</espi:start></espi:timePeriod><espi:value>{round(values[i] * 1000)}</espi:value></espi:IntervalReading>'
+                                   for i in rows)
+                block = (f'<espi:IntervalBlock><espi:interval><espi:duration>{epochs[rows[-1] + 1] - epochs[rows[0]]}</espi:duration>'
+                         f'<espi:start>{epochs[rows[0]]}</espi:start></espi:interval>{readings}</espi:IntervalBlock>')
+                f_out.write(entry(f"{meter_reading}/IntervalBlock/{day + 1}", block, up=f"{meter_reading}/IntervalBlock"))
+        if reading_types_last:
+            f_out.writelines(types)
+        f_out.write('</feed>\n')
+    return path
+
+# Write one file per meter, named the way SCE names its downloads
+def write_usage_files(folder, meters=1, days=1, start=datetime.date(2024, 1, 1), interval_minutes=15, seed=0, mojibake=False):
+    end = start + datetime.timedelta(days=days - 1)
+    paths = []
+    for meter in range(meters):
+        account = f"{8000000000 + meter}"
+        name = f"SCE_Usage_{account}_{start:%m-%d-%y}_to_{end:%m-%d-%y}.csv"
+        paths.append(write_usage_file(os.path.join(folder, name), days, start, interval_minutes, seed + meter, mojibake))
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic SCE Green Button usage files.")
+    parser.add_argument("folder", help="folder for the generated files")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--meters", type=int, default=1)
+    parser.add_argument("--interval", type=int, default=15, help="interval length in minutes")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date(2024, 1, 1), help="first day, YYYY-MM-DD")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mojibake", action="store_true", help="write the non-breaking space as 'Â\\xa0'")
+    parser.add_argument("--espi", action="store_true", help="also write each file as a Green Button ESPI XML feed")
+    args = parser.parse_args()
+
+    os.makedirs(args.folder, exist_ok=True)
+    for meter, path in enumerate(write_usage_files(args.folder, args.meters, args.days, args.start, args.interval, args.seed, args.mojibake)):
+        print("Wrote " + path)
+        if args.espi:
+            print("Wrote " + write_espi_file(os.path.splitext(path)[0] + ".xml", args.days, args.start, args.interval, args.seed + meter))
@@ -0,0 +1,124 @@
+# Description: Compiles an SCE time-of-use rate schedule into lookup tables.
+# Every (season, minute of week) slot is resolved to a TOU period and a delivery rate once, so
+# labelling and costing the intervals is a single integer-indexed gather over their start times.
+
+import datetime
+import json
+import numpy as np
+import pandas as pd
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+          "September", "October", "November", "December"]
+MINUTES_PER_DAY = 24 * 60
+# Day slots 0-6 follow pandas' weekday numbering (Monday is 0).  Slot 7 is used for holidays.
+HOLIDAY_SLOT = 7
+
+# SCE's holidays for TOU billing.  A holiday that falls on a Sunday is observed on the Monday.
+def sce_holidays(year):
+    def nth_weekday(month, weekday, n):
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+    def last_weekday(month, weekday):
+        last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+        return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+    fixed = [datetime.date(year, 1, 1), datetime.date(year, 7, 4), datetime.date(year, 11, 11), datetime.date(year, 12, 25)]
+    fixed = [day + datetime.timedelta(days=1) if day.weekday() == 6 else day for day in fixed]
+    return fixed + [
+        nth_weekday(2, 0, 3),   # Presidents' Day
+        last_weekday(5, 0),     # Memorial Day
+        nth_weekday(9, 0, 1),   # Labor Day
+        nth_weekday(11, 3, 4),  # Thanksgiving
+    ]
+
+def parse_clock(value):
+    hours, minutes = value.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+class Tariff:
+    # seasons: month name -> season, as in BILLING_SEASON_MAP
+    # day_types: weekday number -> day type, as in WEEKDAY_MAP
+    # periods: (season, day_type, start, end, label) rules applied in order.  None matches any season or
+    #          day type, and an end before the start wraps past midnight.
+    # rates: (season, day_type, label) -> $/kwH, as in DELIVERY_COSTS.  Missing combinations cost 0.
+    # holidays: dates billed as holiday_day_type, or "sce" for SCE's holiday calendar
+    def __init__(self, name, seasons, day_types, periods, rates, holidays=(), holiday_day_type="Weekend", default_period="Off-Peak"):
+        self.name = name
+        self.seasons = dict(seasons)
+        self.day_types = dict(day_types)
+        self.periods = list(periods)
+        self.rates = dict(rates)
+        self.holidays = holidays if holidays == "sce" else frozenset(pd.Timestamp(day).date() for day in holidays)
+        self.holiday_day_type = holiday_day_type
+        self.default_period = default_period
+        self.compile()
+
+    def compile(self):
+        self.season_names = sorted(set(self.seasons.values()))
+        self.month_season = np.array([0] + [self.season_names.index(self.seasons[month]) for month in MONTHS])
+        self.slot_day_types = [self.day_types[day] for day in range(7)] + [self.holiday_day_type]
+        self.day_type_names = list(dict.fromkeys(self.slot_day_types))
+        self.slot_day_codes = np.array([self.day_type_names.index(day_type) for day_type in self.slot_day_types], dtype=np.int8)
+        self.period_names = [self.default_period] + sorted({rule[4] for rule in self.periods} - {self.default_period})
+
+        shape = (len(self.season_names), (HOLIDAY_SLOT + 1) * MINUTES_PER_DAY)
+        self.period_table = np.zeros(shape, dtype=np.int8)
+        self.rate_table = np.zeros(shape)
+        for s, season in enumerate(self.season_names):
+            for slot, day_type in enumerate(self.slot_day_types):
+                day = self.period_table[s, slot * MINUTES_PER_DAY:(slot + 1) * MINUTES_PER_DAY]
+                for rule_season, rule_day_type, start, end, label in self.periods:
+                    if rule_season not in (None, season) or rule_day_type not in (None, day_type):
+                        continue
+                    start, end, code = parse_clock(start), parse_clock(end), self.period_names.index(label)
+                    if start < end:
+                        day[start:end] = code
+                    else:
+                        day[start:] = code
+                        day[:end] = code
+                rates = np.array([self.rates.get((season, day_type, label), 0) for label in self.period_names])
+                self.rate_table[s, slot * MINUTES_PER_DAY:(slot + 1) * MINUTES_PER_DAY] = rates[day]
+
+    # Return the (season, minute of week) index of each interval start
+    def slots(self, starts):
+        starts = pd.DatetimeIndex(starts)
+        seasons = self.month_season[starts.month]
+        days = starts.weekday.to_numpy()
+        if self.holidays == "sce":
+            holidays = {day for year in np.unique(starts.year) for day in sce_holidays(int(year))}
+        else:
+            holidays = self.holidays
+        if holidays:
+            days = np.where(pd.Index(starts.date).isin(holidays), HOLIDAY_SLOT, days)
+        minutes = days * MINUTES_PER_DAY + starts.hour.to_numpy() * 60 + starts.minute.to_numpy()
+        return seasons, minutes
+
+    # Return the BillingSeason, BillingDay and TOU labels of each interval start as categoricals
+    def classify(self, starts):
+        seasons, minutes = self.slots(starts)
+        return pd.DataFrame({
+            'BillingSeason': pd.Categorical.from_codes(seasons, self.season_names),
+            'BillingDay': pd.Categorical.from_codes(self.slot_day_codes[minutes // MINUTES_PER_DAY], self.day_type_names),
+            'TOU': pd.Categorical.from_codes(self.period_table[seasons, minutes], self.period_names),
+        })
+
+    # Return the delivery rate of each interval start
+    def rate(self, starts):
+        seasons, minutes = self.slots(starts)
+        return self.rate_table[seasons, minutes]
+
+# Load a tariff from a JSON config file.  See tariffs/TOU-D-PRIME.json for the layout.
+def load_tariff(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return Tariff(
+        name=config['name'],
+        seasons=config['seasons'],
+        day_types={int(day): day_type for day, day_type in config['day_types'].items()},
+        periods=[(p.get('season'), p.get('day_type'), p['start'], p['end'], p['period']) for p in config['periods']],
+        rates={(r['season'], r['day_type'], r['period']): r['rate'] for r in config['rates']},
+        holidays=config.get('holidays', ()),
+        holiday_day_type=config.get('holiday_day_type', "Weekend"),
+        default_period=config.get('default_period', "Off-Peak"),
+    )
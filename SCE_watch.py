@@ -0,0 +1,230 @@
+# Description: Watches the download folder and runs every new SCE usage export through parse and merge.
+# File system events come from watchfiles (inotify on Linux) when it is installed; otherwise the folder is polled.
+# A file is only queued once its size and modification time have stopped changing, so partial writes are never
+# parsed.  One worker processes the queue in order, and the processed files are recorded in a SQLite state file so
+# a restart neither reprocesses them nor misses the ones that arrived while the watcher was down.
+
+import argparse
+import asyncio
+import datetime
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+
+from SCE_download import get_download_folder
+from SCE_ecc import load_ecc_table
+from SCE_instrument import RunReport, stage
+from SCE_parse import ECC_FILE, TOU_D_PRIME, load_tariff
+from SCE_runall import run_all, run_merge
+
+# Modify the path to the watcher's record of processed files
+STATE_FILE = '/path/to/sce_watch.db'
+USAGE_PATTERNS = ["SCE_Usage_*.csv", "SCE_Usage_*.xml"]
+# SCE names each download after its date range, e.g. SCE_Usage_1234567890_05-01-24_to_05-31-24.csv
+RANGE_PATTERN = re.compile(r'_(\d{2}-\d{2}-\d{2})_to_(\d{2}-\d{2}-\d{2})')
+# Browsers write partial downloads next to the final name with one of these suffixes
+PARTIAL_SUFFIXES = [".crdownload", ".part", ".download", ".tmp"]
+# Seconds a file's size and modification time must stay the same before it is processed
+SETTLE_SECONDS = 2.0
+# Seconds between scans when polling, and between safety scans when file system events are used
+POLL_SECONDS = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, status TEXT NOT NULL, error TEXT,
+    seconds REAL, processed TEXT NOT NULL);
+"""
+
+def connect(state=STATE_FILE):
+    con = sqlite3.connect(state)
+    con.executescript(SCHEMA)
+    return con
+
+# True if this version of the file (same size and modification time) has been processed, successfully or not.
+# A failed file is tried again once it changes, e.g. when the same range is downloaded again.
+def is_processed(con, path, size, mtime):
+    row = con.execute("SELECT size, mtime FROM processed WHERE path = ?", (path,)).fetchone()
+    return row is not None and row[0] == size and row[1] == mtime
+
+def mark_processed(con, path, size, mtime, status, error=None, seconds=None):
+    with con:
+        con.execute("INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (path, size, mtime, status, error, seconds, datetime.datetime.now().isoformat(timespec="seconds")))
+
+def is_usage_file(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in USAGE_PATTERNS) and not name.endswith("_parsed.csv")
+
+# Order files by the date range in their name, oldest first, and files without one by modification time
+def file_order(file):
+    path, size, mtime = file
+    match = RANGE_PATTERN.search(os.path.basename(path))
+    if match is None:
+        stamp = datetime.datetime.fromtimestamp(mtime)
+        return stamp, stamp, mtime
+    first, last = (datetime.datetime.strptime(date, "%m-%d-%y") for date in match.groups())
+    return first, last, mtime
+
+# Return (path, size, mtime) of the usage files in the folder that are not still being written, in file_order()
+def scan_folder(folder):
+    names = set(os.listdir(folder))
+    files = []
+    for name in sorted(names):
+        if not is_usage_file(name) or any(name + suffix in names for suffix in PARTIAL_SUFFIXES):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if info.st_size:
+            files.append((path, info.st_size, info.st_mtime))
+    return sorted(files, key=file_order)
+
+# Parse one usage file, or add it to the interval store and merge the rows the store has not exported yet into
+# the workbook, overwriting the workbook rows of revised hours.  Returns the RunReport of the file.
+def process_file(infile, output_dir, ecc, tariff, xlsx_path=None, store=None):
+    report = RunReport(input=infile)
+    if store is None:
+        output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(infile))[0] + "_parsed.csv")
+        run_all(['parse'], infile, output_file, ecc, tariff, report=report)
+        return report
+
+    from SCE_store import update_store
+    try:
+        with report:
+            with stage("store") as record:
+                record["rows_out"] = update_store(infile, store, ecc_file=ecc, tariff=tariff)
+            if xlsx_path and run_merge(None, xlsx_path, store) is None:
+                report.fail("merge failed")
+    except Exception as e:
+        print(f"Error storing {infile}: {e}")
+    return report
+
+class Watcher:
+    def __init__(self, folder, output_dir, ecc, tariff, xlsx_path=None, store=None, state=STATE_FILE,
+                 settle=SETTLE_SECONDS, poll=POLL_SECONDS):
+        # Downloads overlap, so only the store knows which rows the workbook already has
+        if xlsx_path and not store:
+            raise ValueError("merging into a workbook needs an interval store")
+        self.folder = folder
+        self.output_dir = output_dir
+        self.ecc = ecc
+        self.tariff = tariff
+        self.xlsx_path = xlsx_path
+        self.store = store
+        self.con = connect(state)
+        self.settle = settle
+        self.poll = poll
+        # path -> (size, mtime, monotonic time the size and mtime were first seen)
+        self.seen = {}
+        self.queued = set()
+        self.queue = asyncio.Queue()
+        self.changed = asyncio.Event()
+
+    # Queue the files that have settled and have not been processed.  A file settles once its size and mtime
+    # have been the same for settle seconds; a file last written more than settle seconds ago is settled already,
+    # which lets a restarted watcher pick up the exports that arrived while it was down.  Returns True while some
+    # file is still settling.
+    def scan(self):
+        now, wall = time.monotonic(), time.time()
+        settling = False
+        current = set()
+        for path, size, mtime in scan_folder(self.folder):
+            current.add(path)
+            if path in self.queued or is_processed(self.con, path, size, mtime):
+                continue
+            previous = self.seen.get(path)
+            if previous is None or previous[:2] != (size, mtime):
+                self.seen[path] = previous = (size, mtime, now)
+            if now - previous[2] >= self.settle or wall - mtime >= self.settle:
+                del self.seen[path]
+                self.queued.add(path)
+                self.queue.put_nowait((path, size, mtime))
+            else:
+                settling = True
+        for path in set(self.seen) - current:
+            del self.seen[path]
+        return settling
+
+    # Process queued files one at a time in a worker thread, so the event loop keeps watching meanwhile
+    async def work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, size, mtime = await self.queue.get()
+            print(f"Processing {path}...")
+            started = time.perf_counter()
+            try:
+                report = await loop.run_in_executor(None, process_file, path, self.output_dir, self.ecc, self.tariff,
+                                                    self.xlsx_path, self.store)
+                status, error = report.status or "failed", report.error
+            except Exception as e:
+                status, error = "failed", f"{type(e).__name__}: {e}"
+            seconds = round(time.perf_counter() - started, 3)
+            mark_processed(self.con, path, size, mtime, status, error, seconds)
+            print(f"{os.path.basename(path)}: {status} in {seconds}s" + (f" ({error})" if error else ""))
+            self.queued.discard(path)
+            self.queue.task_done()
+
+    # Set the changed event on every file system event in the folder
+    async def events(self):
+        from watchfiles import awatch
+        async for _ in awatch(self.folder):
+            self.changed.set()
+
+    # Watch the folder until cancelled.  With once=True, process the files already there and return.
+    async def run(self, once=False):
+        worker = asyncio.create_task(self.work())
+        watcher = None
+        try:
+            if once:
+                while self.scan():
+                    await asyncio.sleep(self.settle / 4)
+                await self.queue.join()
+                return
+            try:
+                import watchfiles
+                watcher = asyncio.create_task(self.events())
+                print(f"Watching {self.folder} for usage files...")
+            except ImportError:
+                print(f"Polling {self.folder} for usage files every {self.poll}s (pip install watchfiles for file system events)...")
+            while True:
+                settling = self.scan()
+                # While a file is settling, look again soon; otherwise wait for an event or the next poll
+                try:
+                    await asyncio.wait_for(self.changed.wait(), self.settle / 4 if settling else self.poll)
+                except asyncio.TimeoutError:
+                    pass
+                self.changed.clear()
+        finally:
+            for task in (worker, watcher):
+                if task is not None:
+                    task.cancel()
+            self.con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch the download folder and parse and merge new SCE usage files.")
+    parser.add_argument("folder", nargs="?", default=get_download_folder(), help="folder to watch (default: your Downloads folder)")
+    parser.add_argument("--output-dir", help="folder for the _parsed.csv files (default: <folder>/parsed)")
+    parser.add_argument("--xlsx", help="master workbook to merge new rows into (needs --store)")
+    parser.add_argument("--store", help="add new files to this SQLite interval store (see SCE_store.py)")
+    parser.add_argument("--state", default=STATE_FILE, help="SQLite file recording the processed files")
+    parser.add_argument("--ecc", default=ECC_FILE, help="ECC data file")
+    parser.add_argument("--tariff", help="tariff JSON file (default: TOU-D-PRIME)")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, help="seconds a file must stay unchanged before it is processed")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between scans of the folder")
+    parser.add_argument("--once", action="store_true", help="process the files already in the folder and exit")
+    args = parser.parse_args()
+    if args.xlsx and not args.store:
+        parser.error("--xlsx needs --store, so rows of overlapping downloads are not merged twice")
+
+    output_dir = args.output_dir or os.path.join(args.folder, "parsed")
+    os.makedirs(output_dir, exist_ok=True)
+    tariff = load_tariff(args.tariff) if args.tariff else TOU_D_PRIME
+    watcher = Watcher(args.folder, output_dir, load_ecc_table(args.ecc), tariff, args.xlsx, args.store, args.state,
+                      args.settle, args.poll)
+    try:
+        asyncio.run(watcher.run(args.once))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
@@ -0,0 +1,93 @@
+import datetime
+import http.cookiejar
+import os
+import threading
+import urllib.parse
+import urllib.request
+
+import pytest
+
+import SCE_download
+from SCE_standin import PASSWORD, USERNAME, StandInServer
+
+START = datetime.date(2024, 1, 1)
+END = datetime.date(2024, 1, 10)
+
+@pytest.fixture
+def standin():
+    servers = []
+
+    def start(drop_after=0):
+        server = StandInServer(("127.0.0.1", 0), drop_after)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+# Log in through the stand-in's login form and return the session cookies
+def log_in(server, password=PASSWORD):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    form = urllib.parse.urlencode({"username": USERNAME, "password": password}).encode()
+    with opener.open(server.base_url + SCE_download.LOGIN_PATH, form) as response:
+        page = response.geturl()
+    return {cookie.name: cookie.value for cookie in jar}, page
+
+def test_login(standin):
+    server = standin()
+    cookies, page = log_in(server)
+    assert page.endswith(SCE_download.DATA_PATH) and cookies
+    cookies, page = log_in(server, password="wrong")
+    assert page.endswith(SCE_download.LOGIN_PATH) and not cookies
+
+def test_dropped_download_is_resumed(standin, tmp_path):
+    server = standin(drop_after=5000)
+    cookies, _ = log_in(server)
+    path = SCE_download.download_range(START, END, str(tmp_path), cookies, server.base_url, "1234")
+    assert os.path.basename(path) == "SCE_Usage_1234_01-01-24_to_01-10-24.csv"
+    with open(path, "rb") as f_in:
+        assert f_in.read() == server.usage_file(START, END)
+    # The first response was cut short and the rest came from a Range request
+    assert server.downloads == 2
+    assert not os.path.exists(path + ".part")
+
+def test_partial_file_is_continued(standin, tmp_path):
+    server = standin()
+    cookies, _ = log_in(server)
+    body = server.usage_file(START, END)
+    part = tmp_path / (SCE_download.chunk_name(START, END, "1234") + ".part")
+    part.write_bytes(body[:1234])
+    path = SCE_download.download_range(START, END, str(tmp_path), cookies, server.base_url, "1234")
+    with open(path, "rb") as f_in:
+        assert f_in.read() == body
+    # A finished range is not downloaded again
+    assert SCE_download.download_range(START, END, str(tmp_path), cookies, server.base_url, "1234") == path
+    assert server.downloads == 1
+
+def test_expired_session(standin, tmp_path):
+    server = standin()
+    with pytest.raises(PermissionError):
+        SCE_download.download_range(START, END, str(tmp_path), {"SCESESSION": "expired"}, server.base_url, "1234")
+    assert not os.listdir(tmp_path)
+
+def test_download_chunks(standin, tmp_path):
+    server = standin(drop_after=3000)
+    cookies, _ = log_in(server)
+    paths = SCE_download.download_chunks(START, datetime.date(2024, 3, 15), str(tmp_path), cookies, server.base_url,
+                                         "1234", chunk_days=31, workers=3)
+    ranges = {SCE_download.chunk_name(first, last, "1234"): (first, last)
+              for first, last in SCE_download.date_chunks(START, datetime.date(2024, 3, 15), 31)}
+    assert sorted(os.path.basename(path) for path in paths) == sorted(ranges)
+    for path in paths:
+        with open(path, "rb") as f_in:
+            assert f_in.read() == server.usage_file(*ranges[os.path.basename(path)])
+
+def test_wait_for_download(tmp_path):
+    (tmp_path / "SCE_Usage.csv.crdownload").write_bytes(b"partial")
+    with pytest.raises(TimeoutError):
+        SCE_download.wait_for_download(str(tmp_path), timeout=0.2)
+    (tmp_path / "SCE_Usage.csv.crdownload").rename(tmp_path / "SCE_Usage.csv")
+    assert SCE_download.wait_for_download(str(tmp_path), timeout=1) == str(tmp_path / "SCE_Usage.csv")
@@ -0,0 +1,21 @@
+import datetime
+
+import numpy as np
+
+from SCE_espi import read_espi
+from SCE_synthetic import synthetic_series, write_espi_file
+
+# The readings of the hour the clocks go back are summed into one local hour, so every start is unique and no
+# energy is lost
+def test_fall_back_hour(tmp_path):
+    path = write_espi_file(str(tmp_path / "SCE_Usage.xml"), 3, datetime.date(2024, 11, 2))
+    usage = read_espi(path)
+    assert not usage.duplicated(["Start", "Tag"]).any()
+
+    _, delivered, received = synthetic_series(3, datetime.date(2024, 11, 2), 15, 0)
+    totals = usage.groupby("Tag", observed=True)["kwHUsage"].sum()
+    assert np.isclose(totals["delivered"], np.round(np.asarray(delivered) * 1000).sum() / 1000, atol=1e-4)
+    assert np.isclose(totals["generated"], np.round(np.asarray(received) * 1000).sum() / 1000, atol=1e-4)
+
+    repeated = usage[(usage["Tag"] == "delivered") & (usage["Start"] == "2024-11-03 01:00")]
+    assert len(repeated) == 1 and repeated["Minutes"].iloc[0] == 15
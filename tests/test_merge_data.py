@@ -0,0 +1,56 @@
+import os
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import SCE_merge_data
+from SCE_benchmark import write_workbook
+
+SHEET = "xl/worksheets/sheet1.xml"
+PARSED_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Example_sce_usage_parsed.csv")
+
+def rows(count):
+    data = SCE_merge_data.read_csv_data(pd.read_csv(PARSED_FILE).dropna(how="all"))
+    return pd.concat([data] * (count // len(data) + 1), ignore_index=True).head(count)
+
+def append(path, data, chunk_bytes, monkeypatch):
+    monkeypatch.setattr(SCE_merge_data, "CHUNK_BYTES", chunk_bytes)
+    return SCE_merge_data.append_rows(str(path), SCE_merge_data.worksheet_name, SCE_merge_data.table_name, data)
+
+# Small chunks cut rows, cells and </sheetData> at every position, and must give the same sheet as one chunk
+@pytest.mark.parametrize("chunk_bytes", [7, 64, 1000])
+def test_append_in_chunks(tmp_path, monkeypatch, chunk_bytes):
+    paths = [tmp_path / "whole.xlsx", tmp_path / "chunks.xlsx"]
+    write_workbook(paths[0])
+    append(paths[0], rows(300), 1 << 20, monkeypatch)
+    paths[1].write_bytes(paths[0].read_bytes())
+
+    assert append(paths[0], rows(50), 1 << 20, monkeypatch) == 352
+    assert append(paths[1], rows(50), chunk_bytes, monkeypatch) == 352
+    with zipfile.ZipFile(paths[0]) as whole, zipfile.ZipFile(paths[1]) as chunks:
+        assert chunks.testzip() is None
+        assert [item.filename for item in whole.infolist()] == [item.filename for item in chunks.infolist()]
+        for item in whole.infolist():
+            assert whole.read(item.filename) == chunks.read(item.filename)
+
+def test_unchanged_parts_are_copied_raw(tmp_path, monkeypatch):
+    path = tmp_path / "master.xlsx"
+    write_workbook(path)
+    with zipfile.ZipFile(path) as package:
+        before = {item.filename: (item.CRC, item.compress_size) for item in package.infolist()}
+    append(path, rows(10), 1 << 20, monkeypatch)
+    with zipfile.ZipFile(path) as package:
+        after = {item.filename: (item.CRC, item.compress_size) for item in package.infolist()}
+    changed = {name for name in before if before[name] != after[name]}
+    assert changed == {SHEET, "xl/tables/table1.xml"}
+
+def test_workbook_reads_back(tmp_path, monkeypatch):
+    path = tmp_path / "master.xlsx"
+    write_workbook(path)
+    data = rows(30)
+    assert append(path, data, 100, monkeypatch) == 32
+    worksheet = openpyxl.load_workbook(path)[SCE_merge_data.worksheet_name]
+    assert worksheet.tables[SCE_merge_data.table_name].ref == "A1:L32"
+    assert [cell.value for cell in worksheet[32]][1:] == list(data.iloc[-1])[1:]
@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pandas as pd
+
+from SCE_parse import normalize_frame, parse_frame, usage_frame
+
+EXAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Excample_SCE_Usage.csv")
+
+# The netting of the original normalize_kwh(): every delivered row is matched to the first generated row with the
+# same Date, StartTime and EndTime, one row at a time
+def reference_netting(data):
+    data = pd.DataFrame({
+        'Date': data['Start'].dt.strftime('%Y-%m-%d'),
+        'StartTime': data['Start'].dt.strftime('%H:%M:%S'),
+        'EndTime': (data['Start'] + pd.to_timedelta(data['Minutes'].astype('int64'), unit='m')).dt.strftime('%H:%M:%S'),
+        'kwHUsage': data['kwHUsage'].astype(float).round(6),
+        'Tag': data['Tag'].astype(object),
+    })
+    delivered_mask = data['Tag'] == 'delivered'
+    generated_mask = data['Tag'] == 'generated'
+    data['net_kwHUsage'] = data['kwHUsage'].copy()
+    for index, row in data[delivered_mask].iterrows():
+        corresponding_generated = data[
+            (data['Date'] == row['Date']) &
+            (data['StartTime'] == row['StartTime']) &
+            (data['EndTime'] == row['EndTime']) &
+            generated_mask
+        ]
+        if not corresponding_generated.empty:
+            data.at[index, 'net_kwHUsage'] -= corresponding_generated.iloc[0]['kwHUsage']
+    return data['net_kwHUsage'].to_numpy()
+
+def assert_same_netting(data):
+    netted = normalize_frame(data)
+    assert netted['Tag'].equals(data['Tag'])
+    assert netted['Start'].equals(data['Start'])
+    np.testing.assert_allclose(netted['kwHUsage'].to_numpy(dtype=float), reference_netting(data), atol=1e-6)
+
+def test_example_file():
+    data = parse_frame(EXAMPLE_FILE)
+    assert (data['Tag'] == 'generated').any()
+    assert_same_netting(data)
+
+def test_synthetic_frame():
+    starts = pd.date_range("2024-06-01", periods=8, freq="15min").to_numpy()
+    ends = starts + np.timedelta64(15, 'm')
+    # 0-2: both tags, 3-4: delivered only, 5-6: generated only, 7: both, in shuffled order
+    rows = [(0, 1.25, 'delivered'), (0, 0.5, 'generated'), (1, 0.1, 'generated'), (1, 0.3, 'delivered'),
+            (2, 0.2, 'delivered'), (2, 0.7, 'generated'), (3, 0.4, 'delivered'), (4, 0.05, 'delivered'),
+            (5, 0.9, 'generated'), (6, 1.1, 'generated'), (7, 0.6, 'generated'), (7, 0.6, 'delivered')]
+    index = [row[0] for row in rows]
+    data = usage_frame(starts[index], ends[index], [row[1] for row in rows], [row[2] for row in rows])
+    assert_same_netting(data)
+
+    netted = normalize_frame(data)
+    # Delivered-only intervals keep their usage, and generated rows are never changed
+    assert netted.loc[6, 'kwHUsage'] == np.float32(0.4)
+    assert netted.loc[8, 'kwHUsage'] == np.float32(0.9)
+    assert netted.loc[9, 'kwHUsage'] == np.float32(1.1)
+    assert netted.loc[11, 'kwHUsage'] == 0
+
+def test_hourly_and_quarter_hour_rows_do_not_net():
+    # Intervals with the same start but a different length are different intervals
+    starts = np.array(['2024-06-01T10:00', '2024-06-01T10:00'], dtype='datetime64[s]')
+    ends = np.array(['2024-06-01T11:00', '2024-06-01T10:15'], dtype='datetime64[s]')
+    data = usage_frame(starts, ends, [2.0, 0.5], ['delivered', 'generated'])
+    assert_same_netting(data)
+    assert normalize_frame(data).loc[0, 'kwHUsage'] == 2.0
@@ -0,0 +1,92 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+from SCE_parse import decode_timestamps, decode_usage, format_frame, parse_frame
+from SCE_synthetic import write_usage_file
+
+EXAMPLE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Excample_SCE_Usage.csv")
+
+# The original parse_frame(): the file is read row by row with csv.reader and each timestamp is split on 'to'
+def reference_parse(infile):
+    data_rows = []
+    with open(infile, 'r', newline='', encoding='utf-8') as f_in:
+        reader = csv.reader(f_in)
+        tag = ''
+        for row in reader:
+            if not row:
+                continue
+            if 'Received' in row[0]:
+                tag = 'generated'
+            elif 'Delivered' in row[0] or 'Consumption' in row[0]:
+                tag = 'delivered'
+            elif 'to' in row[0]:
+                kwHUsage = float(row[1])
+                parse_row = row[0].split('to')
+                parse_row = [item.replace('Â\xa0', '') for item in parse_row]
+                start = parse_row[0].split(' ')
+                date = start[0].strip()
+                startTime = start[1].strip()
+                end = parse_row[1].split(' ')
+                endTime = end[2].strip()
+                if kwHUsage != 0:
+                    data_rows.append([date, startTime, endTime, kwHUsage, tag])
+    return pd.DataFrame(data_rows, columns=["Date", "StartTime", "EndTime", "kwHUsage", "Tag"])
+
+def assert_same_parse(infile):
+    expected = reference_parse(infile)
+    parsed = format_frame(parse_frame(infile))
+    assert len(expected)
+    for column in ["Date", "StartTime", "EndTime", "Tag"]:
+        assert parsed[column].astype(str).tolist() == expected[column].tolist()
+    np.testing.assert_allclose(parsed['kwHUsage'].to_numpy(dtype=float), expected['kwHUsage'].to_numpy(), atol=1e-6)
+
+# Rewrite a usage file with other line endings, and optionally without the final line break
+def rewrite(infile, outfile, newline, terminated=True):
+    with open(infile, 'rb') as f_in:
+        text = f_in.read().replace(b'\r\n', newline)
+    with open(outfile, 'wb') as f_out:
+        f_out.write(text if terminated else text.rstrip(newline))
+    return outfile
+
+def test_example_file():
+    assert_same_parse(EXAMPLE_FILE)
+
+def test_mojibake_file(tmp_path):
+    assert_same_parse(write_usage_file(str(tmp_path / "SCE_Usage.csv"), 3, seed=4, mojibake=True))
+
+def test_line_endings(tmp_path):
+    assert_same_parse(rewrite(EXAMPLE_FILE, str(tmp_path / "lf.csv"), b'\n'))
+    assert_same_parse(rewrite(EXAMPLE_FILE, str(tmp_path / "unterminated.csv"), b'\r\n', terminated=False))
+    assert_same_parse(rewrite(EXAMPLE_FILE, str(tmp_path / "lf_unterminated.csv"), b'\n', terminated=False))
+
+def test_mixed_separators(tmp_path):
+    # The first row's separator is wider than the second's, whose usage field ends where the first comma was
+    path = tmp_path / "SCE_Usage.csv"
+    path.write_bytes((
+        "Energy Delivered time period,Usage(Real energy in kilowatt-hours),Reading quality\r\n"
+        "2024-11-18 10:00:00Â\xa0to 2024-11-18 10:15:00,12.345,actual\r\n"
+        "2024-11-18 14:15:00 to 2024-11-18 14:30:00,7.,actual\r\n"
+    ).encode('utf-8'))
+    assert_same_parse(str(path))
+
+def test_decode_timestamps():
+    text = b"2024-02-29 23:45:00,1970-01-01 00:00:00,2100-03-01 12:00:01,2024-1x-01 00:00:00," + b" " * 32
+    buf = np.frombuffer(text, dtype=np.uint8)
+    stamps, valid = decode_timestamps(buf, np.array([0, 20, 40, 60]))
+    expected = pd.to_datetime(["2024-02-29 23:45:00", "1970-01-01 00:00:00", "2100-03-01 12:00:01"]).to_numpy()
+    assert (stamps[:3] == expected.astype('datetime64[s]')).all()
+    assert valid.tolist() == [True, True, True, False]
+
+def test_decode_usage():
+    fields = [b"0.13", b"-1.2", b"4", b"7.", b"0.000001", b"1.5e-3", b"123456789.5", b"0.30000000000000004"]
+    text = b"".join(field + (b",actual\r\n" if i % 2 else b"\n") for i, field in enumerate(fields)) + b" " * 16
+    starts = []
+    position = 0
+    for i, field in enumerate(fields):
+        starts.append(position)
+        position += len(field) + (len(b",actual\r\n") if i % 2 else 1)
+    buf = np.frombuffer(text, dtype=np.uint8)
+    kwHUsage = decode_usage(text, buf, np.array(starts))
+    assert kwHUsage.tolist() == [float(field) for field in fields]
@@ -0,0 +1,53 @@
+import datetime
+import os
+import shutil
+
+import openpyxl
+
+import SCE_merge_data
+from SCE_benchmark import write_workbook
+from SCE_store import load_hourly, pending_hourly, update_store
+from SCE_synthetic import write_usage_file
+
+ECC_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Example_ECC_data.csv")
+
+def download(folder, store, ecc, start, days, seed):
+    end = start + datetime.timedelta(days=days - 1)
+    path = folder / f"SCE_Usage_1234_{start:%m-%d-%y}_to_{end:%m-%d-%y}.csv"
+    write_usage_file(str(path), days, start, seed=seed)
+    update_store(str(path), str(store), ecc_file=ecc)
+
+# (Date, StartTime, Tag, kwHUsage) of every filled data row of the workbook, after the template row
+def workbook_rows(path):
+    worksheet = openpyxl.load_workbook(path)[SCE_merge_data.worksheet_name]
+    rows = []
+    for date, start, _, kwh, tag, *_ in worksheet.iter_rows(min_row=3, values_only=True):
+        if tag is not None:
+            rows.append((date.date(), start, tag, round(kwh, 6)))
+    return sorted(rows)
+
+def store_rows(store):
+    hourly = SCE_merge_data.read_csv_data(load_hourly(str(store)).drop(columns="account"))
+    return sorted(zip(hourly["Date"], hourly["StartTime"], hourly["Tag"], hourly["kwHUsage"].round(6)))
+
+# A later download, a backfill of earlier days and a download revising exported hours must leave the workbook
+# holding exactly the stored rows
+def test_backfill_and_revisions(tmp_path):
+    ecc = shutil.copy(ECC_FILE, tmp_path)
+    store, xlsx = tmp_path / "store.db", tmp_path / "master.xlsx"
+    write_workbook(xlsx)
+
+    download(tmp_path, store, ecc, datetime.date(2024, 3, 10), 2, seed=0)
+    assert SCE_merge_data.merge_data(None, str(xlsx), str(store)) == 2 + len(store_rows(store))
+    download(tmp_path, store, ecc, datetime.date(2024, 3, 1), 2, seed=1)
+    last_row = SCE_merge_data.merge_data(None, str(xlsx), str(store))
+    assert last_row == 2 + len(store_rows(store))
+    assert workbook_rows(xlsx) == store_rows(store)
+
+    download(tmp_path, store, ecc, datetime.date(2024, 3, 11), 1, seed=2)
+    revised = pending_hourly(str(store))
+    assert revised["xlsx_row"].notna().sum() > 20
+    assert SCE_merge_data.merge_data(None, str(xlsx), str(store)) == last_row + revised["xlsx_row"].isna().sum()
+    assert workbook_rows(xlsx) == store_rows(store)
+    assert pending_hourly(str(store)).empty
+    assert SCE_merge_data.merge_data(None, str(xlsx), str(store)) == 0